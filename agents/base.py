@@ -1,12 +1,35 @@
 # agents/base.py
+from utils.metrics import RunMetrics
+from utils.prompt_codec import check_budget
+
 class BaseAgent:
-    def __init__(self, name, llm_config=None):
+    def __init__(self, name, llm_config=None, on_progress=None, metrics=None):
         self.name = name
         self.llm_config = llm_config or {}
         self.logs = []
+        # Optional callback(agent_name, partial_df) for showing results early
+        self.on_progress = on_progress
+        # Shared with the other agents of a run when the orchestrator passes one
+        self.metrics = metrics if metrics is not None else RunMetrics()
 
     def log(self, message):
         self.logs.append(f"[{self.name}] {message}")
 
+    def check_prompt_budget(self, prompts):
+        max_tokens = self.llm_config.get("max_prompt_tokens")
+        for n, prompt in enumerate(prompts, 1):
+            tokens, fits = check_budget(prompt, max_tokens)
+            if not fits:
+                # A single account larger than the budget cannot be split further
+                self.log(f"Prompt block {n} is ~{tokens} tokens, over the {max_tokens} token budget.")
+
+    def stage(self, name, **counts):
+        """Record the block as stage ``<agent>.<name>`` in the run metrics."""
+        return self.metrics.stage(f"{self.name}.{name}", **counts)
+
+    def progress(self, partial_df):
+        if self.on_progress is not None:
+            self.on_progress(self.name, partial_df)
+
     def run(self, input_data, sop_context=None):
         raise NotImplementedError("Each agent must implement a run() method")
@@ -1,31 +1,149 @@
 # agents/discrepancy_resolution.py
 from .base import BaseAgent
-from openai import AzureOpenAI
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
-from io import StringIO
-import re
+from utils.batching import row_blocks
+from utils.csv_stream import stream_csv_tables
+from utils.llm_cache import cache_from_config
+from utils.prompt_codec import PromptCodec, to_prompt_csv
+from utils.schema import normalize_recon
+from utils.sop_index import relevant_sop
+
+SUGGESTION_COLUMNS = ["Ref 1", "Issue", "Suggested Resolution"]
 
 class DiscrepancyResolutionAgent(BaseAgent):
     def run(self, input_data, sop_context=None):
-        recon_df = input_data["recon_df"]
+        recon_df = normalize_recon(input_data["recon_df"])
         self.log("Filtering unmatched rows.")
 
+        # Status is already an upper-cased categorical after normalization
+        suggestions_df = self.resolve_batches([recon_df[recon_df['Status'] != 'MATCHED']], sop_context)
+        if suggestions_df is None:
+            return {"recon_df": recon_df}
+        return {
+            "recon_df": recon_df,
+            "suggestions_df": suggestions_df
+        }
+
+    def resolve_batches(self, batches, sop_context=None, max_workers=1):
+        """Suggest resolutions for batches of unmatched reconciliation rows.
+
+        ``batches`` may be any iterable, so batches can be resolved while the
+        analyzer is still producing the next ones. With ``max_workers`` > 1,
+        that many batches are resolved at once in worker threads, and the next
+        batch is only taken once a worker is free. Returns the suggestions of
+        all batches in order, or None if there were no unmatched rows at all.
+        """
         if sop_context and sop_context.strip():
             self.log("Using provided SOP for discrepancy resolution.")
             self.log(f"SOP length: {len(sop_context.split())} words")
+            if len(sop_context.split()) > self.llm_config.get("sop_full_max_words", 1500):
+                self.log("Long SOP: each prompt gets only its most relevant sections.")
         else:
             self.log("No SOP provided, using default resolution guidelines.")
 
-        # Convert Status column to string and handle missing values
-        recon_df['Status'] = recon_df['Status'].fillna('').astype(str)
-        unmatched_df = recon_df[recon_df['Status'].str.upper() != 'MATCHED']
-        
-        if unmatched_df.empty:
+        if max_workers <= 1:
+            parts = [self._resolve(unmatched_df, sop_context) for unmatched_df in batches if not unmatched_df.empty]
+        else:
+            parts = self._resolve_concurrently(batches, sop_context, max_workers)
+        if not parts:
             self.log("No unmatched transactions found.")
-            return {"recon_df": recon_df}
+            return None
+        return pd.concat(parts, ignore_index=True)
+
+    def _resolve_concurrently(self, batches, sop_context, max_workers):
+        free = threading.Semaphore(max_workers)
+        futures = []
+        with ThreadPoolExecutor(max_workers) as pool:
+            batches = iter(batches)
+            while True:
+                free.acquire()
+                if any(future.done() and future.exception() for future in futures):
+                    break
+                unmatched_df = next(batches, None)
+                if unmatched_df is None:
+                    break
+                if unmatched_df.empty:
+                    free.release()
+                    continue
+                # Calls made for the batch count toward the caller's metrics stages
+                future = pool.submit(contextvars.copy_context().run, self._resolve, unmatched_df, sop_context)
+                future.add_done_callback(lambda _: free.release())
+                futures.append(future)
+        return [future.result() for future in futures]
 
-        csv_data = unmatched_df.to_csv(index=False)
-        prompt = f"""
+    def _resolve(self, unmatched_df, sop_context):
+        # Unmatched rows are resolved independently, so they can be split freely
+        with self.stage("prompt building", rows_in=len(unmatched_df)) as stage:
+            codec = PromptCodec()
+            compact_df = codec.compact(unmatched_df, "Recon")
+            blocks = row_blocks(compact_df, self.llm_config.get("block_token_budget", 8000))
+            self.log(f"Preparing {len(blocks)} GPT prompt block(s) for {len(unmatched_df)} unmatched rows.")
+            prompts = [
+                self._build_prompt(block, codec.legend(block), self._block_sop(sop_context, codec, block))
+                for block in blocks
+            ]
+            self.check_prompt_budget(prompts)
+            stage["prompts"] = len(prompts)
+
+        def decode(records):
+            # Row IDs in Ref 1 point back at the reconciliation rows
+            return codec.decode_records(
+                records, "Ref 1", lambda side, index: self._row_reference(unmatched_df, index)
+            )
+
+        try:
+            cache = cache_from_config(self.llm_config)
+            with self.stage("gpt resolution", prompts=len(prompts)) as stage:
+                records, repaired, dropped = stream_csv_tables(
+                    self.llm_config,
+                    prompts,
+                    SUGGESTION_COLUMNS,
+                    cache,
+                    on_records=lambda rows: self.progress(pd.DataFrame(decode(rows), columns=SUGGESTION_COLUMNS)),
+                    stats=self.metrics.llm,
+                )
+                stage.update(rows_out=len(records), repaired_rows=repaired, dropped_rows=len(dropped))
+            if cache is not None:
+                self.log(f"Response cache: {cache.stats()}.")
+            self.log("Received resolution suggestions from GPT.")
+            if repaired:
+                self.log(f"Recovered {repaired} malformed row(s) with a follow-up request.")
+            if dropped:
+                self.log(f"Dropped {len(dropped)} row(s) GPT could not return in the expected format.")
+
+            suggestions_df = pd.DataFrame(decode(records), columns=SUGGESTION_COLUMNS)
+
+            self.log("Successfully parsed suggestions.")
+            return suggestions_df
+
+        except Exception as e:
+            self.log(f"Error resolving discrepancies: {e}")
+            raise
+
+    def _row_reference(self, recon_df, index):
+        # The match group when there is one, else the row's source reference
+        for col in ("Ref 1", "Ref 2"):
+            value = recon_df.at[index, col]
+            if pd.notna(value) and str(value).strip():
+                return str(value)
+        return f"No {recon_df.at[index, 'No']}"
+
+    def _block_sop(self, sop_context, codec, block):
+        # Long SOPs are cut down to the sections about this block's issues
+        terms = codec.distinct_values([block], "Tran Code") + codec.distinct_values([block], "Rule")
+        return relevant_sop(
+            sop_context,
+            " ".join(terms) + " unmatched partial discrepancy resolution split reversal currency date",
+            max_words=self.llm_config.get("sop_full_max_words", 1500),
+            k=self.llm_config.get("sop_top_k", 5),
+        )
+
+    def _build_prompt(self, unmatched_df, legend, sop_context):
+        csv_data = to_prompt_csv(unmatched_df)
+        return f"""
 You are a bank reconciliation expert. Your job is to analyze unmatched transactions and suggest resolutions.
 
 **Instructions:**
@@ -34,72 +152,17 @@ Ref 1,Issue,Suggested Resolution
 - If a field contains a comma, wrap it in double quotes.
 - Do NOT add any explanations, markdown, code blocks, summary lines, or extra headers.
 - Every row must have exactly 3 columns, matching the header above.
+- Each input row starts with an id. Put the id of the transaction a suggestion is about in its Ref 1 column.
+- Values starting with # are codes explained in the legend; you may use them as-is.
 
 **SOP:**
 {sop_context or 'No SOP provided. Use general resolution guidelines: 1. Check for date mismatches within a 3-day window. 2. Look for amount splits or combined entries. 3. Verify similar transaction codes. 4. Investigate currency conversion differences. 5. Check for reversed or correction entries.'}
 
+**Legend:**
+{legend}
+
 **Unmatched Transactions:**
 {csv_data}
 
 Remember: Output ONLY the CSV data, with the exact columns and order specified above. No extra text, explanations, or formatting.
 """
-
-        try:
-            # Use AzureOpenAI client
-            client = AzureOpenAI(
-                api_key=self.llm_config.get("api_key"),
-                api_version=self.llm_config.get("api_version"),
-                azure_endpoint=self.llm_config.get("azure_endpoint")
-            )
-            response = client.chat.completions.create(
-                model=self.llm_config.get("model_name"),
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0
-            )
-            content = response.choices[0].message.content
-            gpt_output = content.strip() if content else ""
-            self.log("Received resolution suggestions from GPT.")
-
-            # Clean up the output
-            # Remove any markdown code block syntax
-            gpt_output = re.sub(r'```\w*\n?', '', gpt_output)
-            gpt_output = gpt_output.strip()
-
-            # Ensure we have the header
-            expected_header = "Ref 1,Issue,Suggested Resolution"
-            if not gpt_output.startswith(expected_header):
-                gpt_output = expected_header + "\n" + gpt_output
-
-            try:
-                # Try parsing with pandas
-                suggestions_df = pd.read_csv(StringIO(gpt_output))
-            except Exception as e:
-                self.log(f"Error parsing CSV: {e}")
-                # If parsing fails, try to fix common issues
-                lines = gpt_output.split('\n')
-                cleaned_lines = []
-                num_columns = len(expected_header.split(','))
-                
-                for line in lines:
-                    if line.strip():  # Skip empty lines
-                        fields = line.split(',')
-                        if len(fields) > num_columns:
-                            # If we have too many columns, combine excess columns
-                            fields = fields[:num_columns-1] + [','.join(fields[num_columns-1:])]
-                        elif len(fields) < num_columns:
-                            # If we have too few columns, pad with empty strings
-                            fields.extend([''] * (num_columns - len(fields)))
-                        cleaned_lines.append(','.join(fields))
-                
-                cleaned_csv = '\n'.join(cleaned_lines)
-                suggestions_df = pd.read_csv(StringIO(cleaned_csv))
-
-            self.log("Successfully parsed suggestions.")
-            return {
-                "recon_df": recon_df,
-                "suggestions_df": suggestions_df
-            }
-
-        except Exception as e:
-            self.log(f"Error resolving discrepancies: {e}")
-            raise
\ No newline at end of file
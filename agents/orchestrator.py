@@ -3,46 +3,317 @@ from .raw_data_collector import RawDataCollectorAgent
 from .transaction_analyzer import TransactionAnalyzerAgent
 from .discrepancy_resolution import DiscrepancyResolutionAgent
 from .report_generator import ReportGeneratorAgent
+import cProfile
+import contextlib
+import io
+import multiprocessing
+import os
+import pstats
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from utils import llm
+from utils.matching import renumber_refs
+from utils.metrics import RunMetrics
+from utils.open_items import store_from_config
+from utils.pipeline import Pipeline
+from utils.sharding import merge_shards, read_frames, shard_ids, write_frames
+
+
+def _analyze_and_resolve(llm_config, metrics, step1, sop_text, on_progress=None):
+    """Steps 2 and 3 one after another; returns ``(step3, logs)``."""
+    # Step 2: Analyze transactions
+    tx_agent = TransactionAnalyzerAgent(
+        name="TransactionAnalyzer", llm_config=llm_config, on_progress=on_progress, metrics=metrics
+    )
+    with metrics.stage("TransactionAnalyzer", rows_in=len(step1["edw_df"]) + len(step1["journal_df"])) as stage:
+        step2 = tx_agent.run(step1, sop_context=sop_text)
+        stage["rows_out"] = len(step2["recon_df"])
+
+    # Step 3: Resolve discrepancies
+    disc_agent = DiscrepancyResolutionAgent(
+        name="DiscrepancyResolver", llm_config=llm_config, on_progress=on_progress, metrics=metrics
+    )
+    with metrics.stage("DiscrepancyResolver", rows_in=len(step2["recon_df"])) as stage:
+        step3 = disc_agent.run(step2, sop_context=sop_text)
+        suggestions_df = step3.get("suggestions_df")
+        stage["rows_out"] = 0 if suggestions_df is None else len(suggestions_df)
+    return step3, tx_agent.logs + disc_agent.logs
+
+
+def _reconcile_shard(paths, sop_text, llm_config):
+    """Run steps 2 and 3 on one shard in a worker process. The shard's
+    results go back as Arrow files next to its input; only their paths, the
+    logs and the metrics are pickled."""
+    frames = read_frames(paths)
+    metrics = RunMetrics(trace_memory=llm_config.get("metrics_trace_memory", False))
+    step3, logs = _analyze_and_resolve(llm_config, metrics, frames, sop_text)
+    out_dir = os.path.join(os.path.dirname(paths["edw_df"]), "out")
+    return {
+        "paths": write_frames({"recon_df": step3["recon_df"], "suggestions_df": step3.get("suggestions_df")}, out_dir),
+        "logs": logs,
+        "stages": metrics.stages,
+        "llm": metrics.llm.counters,
+        "latencies": metrics.llm.latencies,
+    }
+
 
 class AgentOrchestrator:
     def __init__(self, llm_config):
         self.llm_config = llm_config
         self.logs = []
+        # Filled in by run_all for callers that need more than the report
+        self.recon_df = None
+        self.report_path = None
+        self.metrics = None
+
+    def run_all(self, uploaded_file, sop_text, on_progress=None):
+        self.metrics = RunMetrics(trace_memory=self.llm_config.get("metrics_trace_memory", False))
+        profile_path = self.llm_config.get("profile_path")
+        profiler = cProfile.Profile() if profile_path else None
+        if profiler is not None:
+            profiler.enable()
+        try:
+            with self.metrics.stage("Total"):
+                result = self._run_steps(uploaded_file, sop_text, on_progress)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self._dump_profile(profiler, profile_path)
+
+        # The report's own stages are only complete once it is written
+        # A temporary report directory is gone once the report is closed, so
+        # by default the JSON is only written next to a configured report_dir
+        report_dir = self.llm_config.get("report_dir")
+        metrics_path = self.llm_config.get(
+            "metrics_path", os.path.join(report_dir, "Run_Metrics.json") if report_dir else ""
+        )
+        if metrics_path:
+            self.metrics.write_json(metrics_path)
+            self.logs.append(f"[Orchestrator] Run metrics written to {metrics_path}.")
+        return result
+
+    def _dump_profile(self, profiler, profile_path):
+        # Only the orchestrating thread is profiled, GPT worker threads are not
+        profiler.dump_stats(profile_path)
+        hot = io.StringIO()
+        pstats.Stats(profiler, stream=hot).sort_stats("cumulative").print_stats(10)
+        self.logs.append(f"[Orchestrator] Profile written to {profile_path}; top functions by cumulative time:")
+        self.logs.append(hot.getvalue())
 
-    def run_all(self, uploaded_file, sop_text):
+    def _run_steps(self, uploaded_file, sop_text, on_progress):
+        metrics = self.metrics
         try:
             # Step 1: Collect raw data
-            raw_agent = RawDataCollectorAgent(name="RawDataCollector", llm_config=self.llm_config)
-            step1 = raw_agent.run(uploaded_file)
+            raw_agent = RawDataCollectorAgent(name="RawDataCollector", llm_config=self.llm_config, metrics=metrics)
+            with metrics.stage("RawDataCollector") as stage:
+                step1 = raw_agent.run(uploaded_file)
+                stage["rows_out"] = len(step1["edw_df"]) + len(step1["journal_df"])
             self.logs.extend(raw_agent.logs)
 
             # Store original data
             edw_df = step1["edw_df"]
             journal_df = step1["journal_df"]
 
-            # Step 2: Analyze transactions
-            tx_agent = TransactionAnalyzerAgent(name="TransactionAnalyzer", llm_config=self.llm_config)
-            step2 = tx_agent.run(step1, sop_context=sop_text)
-            self.logs.extend(tx_agent.logs)
-
-            # Step 3: Resolve discrepancies
-            disc_agent = DiscrepancyResolutionAgent(name="DiscrepancyResolver", llm_config=self.llm_config)
-            step3 = disc_agent.run(step2, sop_context=sop_text)
-            self.logs.extend(disc_agent.logs)
-
-            # Step 4: Generate report (include original data)
-            report_agent = ReportGeneratorAgent(name="ReportGenerator", llm_config=self.llm_config)
-            final_data = {
-                "recon_df": step3["recon_df"],
-                "suggestions_df": step3.get("suggestions_df", None),
-                "edw_df": edw_df,
-                "journal_df": journal_df
-            }
-            step4 = report_agent.run(final_data)
-            self.logs.extend(report_agent.logs)
+            # Incremental mode: only new rows plus the open items they may close
+            store = store_from_config(self.llm_config)
+            if store is not None:
+                with metrics.stage("OpenItems.prepare", rows_in=len(edw_df) + len(journal_df)) as stage:
+                    frames, stats = store.prepare(edw_df, journal_df)
+                    stage["rows_out"] = len(frames["EDW"]) + len(frames["Journal"])
+                for side, counts in stats.items():
+                    self.logs.append(
+                        f"[Orchestrator] {side}: {counts['new']} new rows, {counts['skipped']} already seen, "
+                        f"{counts['carried']} open items carried forward."
+                    )
+                step1 = {"edw_df": frames["EDW"], "journal_df": frames["Journal"]}
+
+            def close_items(recon_df):
+                if store is None:
+                    return
+                with metrics.stage("OpenItems.update", rows_in=len(recon_df)):
+                    counts = store.update(frames, recon_df)
+                self.logs.append(
+                    f"[Orchestrator] Closed {counts['closed']} items, {counts['open']} still open ({store.stats()})."
+                )
+
+            # Steps 2-4: over shards in worker processes for large inputs,
+            # else overlapped unless the pipeline is turned off
+            if self._shard_count(step1):
+                run_steps = self._run_sharded
+            elif self.llm_config.get("pipeline", True):
+                run_steps = self._run_pipelined
+            else:
+                run_steps = self._run_sequential
+            recon_df, step4 = run_steps(step1, edw_df, journal_df, sop_text, on_progress, close_items)
+            self.recon_df = recon_df
+            self.report_path = step4["report_path"]
 
             return step4["excel_file"], self.logs
 
         except Exception as e:
             self.logs.append(f"[Orchestrator] ❌ Error: {e}")
             raise
+
+    def _run_sequential(self, step1, edw_df, journal_df, sop_text, on_progress, close_items):
+        metrics = self.metrics
+        step3, logs = _analyze_and_resolve(self.llm_config, metrics, step1, sop_text, on_progress)
+        self.logs.extend(logs)
+
+        close_items(step3["recon_df"])
+
+        # Step 4: Generate report (include original data)
+        report_agent = ReportGeneratorAgent(name="ReportGenerator", llm_config=self.llm_config, metrics=metrics)
+        final_data = {
+            "recon_df": step3["recon_df"],
+            "suggestions_df": step3.get("suggestions_df", None),
+            "edw_df": edw_df,
+            "journal_df": journal_df
+        }
+        with metrics.stage("ReportGenerator", rows_in=len(step3["recon_df"])):
+            step4 = report_agent.run(final_data)
+        self.logs.extend(report_agent.logs)
+        return step3["recon_df"], step4
+
+    def _run_pipelined(self, step1, edw_df, journal_df, sop_text, on_progress, close_items):
+        """Steps 2-4 with the resolver and the report writer in their own
+        threads: unmatched rows reach the resolver as each GPT block completes,
+        and the raw sheets are written while GPT is still working."""
+        metrics = self.metrics
+        tx_agent = TransactionAnalyzerAgent(
+            name="TransactionAnalyzer", llm_config=self.llm_config, on_progress=on_progress, metrics=metrics
+        )
+        # Progress callbacks (Streamlit) only work on the calling thread
+        disc_agent = DiscrepancyResolutionAgent(name="DiscrepancyResolver", llm_config=self.llm_config, metrics=metrics)
+        report_agent = ReportGeneratorAgent(name="ReportGenerator", llm_config=self.llm_config, metrics=metrics)
+
+        with Pipeline(self.llm_config.get("pipeline_queue_size", 4)) as pipeline:
+            unmatched = pipeline.channel()
+            report_frames = pipeline.channel()
+
+            def resolve():
+                with metrics.stage("DiscrepancyResolver") as stage:
+                    stage["rows_in"] = 0
+
+                    def batches():
+                        # Whatever queued up while the last batch was resolved goes together
+                        for batch in unmatched.batches():
+                            unmatched_df = pd.concat(batch)
+                            stage["rows_in"] += len(unmatched_df)
+                            yield unmatched_df
+
+                    suggestions_df = disc_agent.resolve_batches(
+                        batches(), sop_text, max_workers=self.llm_config.get("max_concurrency", 4)
+                    )
+                    stage["rows_out"] = 0 if suggestions_df is None else len(suggestions_df)
+                return suggestions_df
+
+            def write_report():
+                with metrics.stage("ReportGenerator"):
+                    return report_agent.write(report_frames)
+
+            pipeline.start("resolve", resolve)
+            pipeline.start("report", write_report)
+            # The raw sheets do not depend on the reconciliation
+            report_frames.put(("edw_df", edw_df))
+            report_frames.put(("journal_df", journal_df))
+
+            with metrics.stage("TransactionAnalyzer", rows_in=len(step1["edw_df"]) + len(step1["journal_df"])) as stage:
+                step2 = tx_agent.run(step1, sop_context=sop_text, on_unmatched=unmatched.put)
+                stage["rows_out"] = len(step2["recon_df"])
+            unmatched.close()
+            # GPT blocks were handed over in completion order but are merged in prompt order
+            suggestions_df = renumber_refs(pipeline.result("resolve"), step2.get("renumbered"))
+            recon_df = step2["recon_df"]
+
+            # Merge: the complete reconciliation and suggestions go in last
+            close_items(recon_df)
+            report_frames.put(("recon_df", recon_df))
+            report_frames.put(("suggestions_df", suggestions_df))
+            report_frames.close()
+            step4 = pipeline.result("report")
+
+        self.logs.extend(tx_agent.logs)
+        self.logs.extend(disc_agent.logs)
+        self.logs.extend(report_agent.logs)
+        return recon_df, step4
+
+    def _shard_count(self, step1):
+        """Shards to split the input into, or 0 to reconcile it as a whole."""
+        workers = self.llm_config.get("shard_workers", 0)
+        rows = len(step1["edw_df"]) + len(step1["journal_df"])
+        # Below shard_min_rows, starting the worker processes costs more than it saves
+        if workers < 2 or rows < self.llm_config.get("shard_min_rows", 50_000):
+            return 0
+        return self.llm_config.get("shards", 2 * workers)
+
+    def _run_sharded(self, step1, edw_df, journal_df, sop_text, on_progress, close_items):
+        """Steps 2 and 3 per shard in a process pool, merged for step 4. The
+        report writer starts on the raw sheets while the shards run."""
+        metrics = self.metrics
+        n_shards = self._shard_count(step1)
+        ids = shard_ids(step1["edw_df"], step1["journal_df"], n_shards)
+        if ids is None:
+            self.logs.append("[Orchestrator] No account column to shard by, reconciling the input as a whole.")
+            return self._run_sequential(step1, edw_df, journal_df, sop_text, on_progress, close_items)
+        report_agent = ReportGeneratorAgent(name="ReportGenerator", llm_config=self.llm_config, metrics=metrics)
+
+        with tempfile.TemporaryDirectory(prefix="recon_shards_", ignore_cleanup_errors=True) as work_dir, \
+                Pipeline(self.llm_config.get("pipeline_queue_size", 4)) as pipeline:
+            report_frames = pipeline.channel()
+
+            def write_report():
+                with metrics.stage("ReportGenerator"):
+                    return report_agent.write(report_frames)
+
+            pipeline.start("report", write_report)
+            report_frames.put(("edw_df", edw_df))
+            report_frames.put(("journal_df", journal_df))
+
+            with metrics.stage("Shards.split", rows_in=len(step1["edw_df"]) + len(step1["journal_df"])) as stage:
+                shards = []
+                for n in range(n_shards):
+                    frames = {"edw_df": step1["edw_df"][ids[0] == n], "journal_df": step1["journal_df"][ids[1] == n]}
+                    if frames["edw_df"].empty and frames["journal_df"].empty:
+                        continue
+                    shards.append((n, write_frames(frames, os.path.join(work_dir, f"shard_{n}"))))
+                stage["shards"] = len(shards)
+            self.logs.append(f"[Orchestrator] Reconciling {len(shards)} shard(s) by Bus Entity and account.")
+
+            workers = min(self.llm_config.get("shard_workers", 0), len(shards))
+            # Spawned, not forked: the report writer thread is already running
+            context = multiprocessing.get_context("spawn")
+            with metrics.stage("Shards.run", shards=len(shards)):
+                with contextlib.ExitStack() as stack:
+                    # GPT calls in flight stay capped across all shards: by the cap this
+                    # process already shares (e.g. as a batch job), else by max_concurrency
+                    slots = llm.get_shared_slots()
+                    if slots is None:
+                        manager = stack.enter_context(context.Manager())
+                        slots = manager.BoundedSemaphore(self.llm_config.get("max_concurrency", 4))
+                    config = llm.share_quota(self.llm_config, workers)
+                    with ProcessPoolExecutor(
+                        workers, mp_context=context, initializer=llm.set_shared_slots, initargs=(slots,)
+                    ) as pool:
+                        futures = [pool.submit(_reconcile_shard, paths, sop_text, config) for _, paths in shards]
+                        results = [future.result() for future in futures]
+                for (n, _), result in zip(shards, results):
+                    self.logs.extend(f"[Shard {n}] {line}" for line in result["logs"])
+                    metrics.stages.extend({**record, "stage": f"Shard {n}.{record['stage']}"} for record in result["stages"])
+                    metrics.llm.absorb(result["llm"], result["latencies"])
+
+            with metrics.stage("Shards.merge") as stage:
+                recon_df, suggestions_df = merge_shards(
+                    (frames["recon_df"], frames.get("suggestions_df"))
+                    for frames in (read_frames(result["paths"]) for result in results)
+                )
+                stage["rows_out"] = len(recon_df)
+
+            close_items(recon_df)
+            report_frames.put(("recon_df", recon_df))
+            report_frames.put(("suggestions_df", suggestions_df))
+            report_frames.close()
+            step4 = pipeline.result("report")
+
+        self.logs.extend(report_agent.logs)
+        return recon_df, step4
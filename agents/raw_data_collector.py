@@ -1,17 +1,22 @@
 # agents/raw_data_collector.py
-import pandas as pd
 from .base import BaseAgent
+from utils.ingest import load_sheets
+from utils.schema import normalize_source
 
 class RawDataCollectorAgent(BaseAgent):
     def run(self, uploaded_file, sop_context=None):
-        self.log("Reading Excel sheets: EDW and Journal")
+        self.log("Reading sheets: EDW and Journal")
 
         try:
-            edw_df = pd.read_excel(uploaded_file, sheet_name="EDW")
-            journal_df = pd.read_excel(uploaded_file, sheet_name="Journal")
-            self.log("Successfully read both sheets.")
+            # One streaming pass over the workbook (or the CSV/Parquet pair)
+            frames = load_sheets(
+                uploaded_file, chunk_rows=self.llm_config.get("ingest_chunk_rows", 50_000)
+            )
+            edw_df = normalize_source(frames["EDW"], "EDW")
+            journal_df = normalize_source(frames["Journal"], "Journal")
+            self.log(f"Successfully read both sheets ({len(edw_df)} EDW rows, {len(journal_df)} Journal rows).")
         except Exception as e:
-            self.log(f"Error reading Excel file: {e}")
+            self.log(f"Error reading input file: {e}")
             raise
 
         return {"edw_df": edw_df, "journal_df": journal_df}
@@ -1,43 +1,171 @@
 # agents/report_generator.py
 from .base import BaseAgent
-from io import BytesIO
-import pandas as pd
+import io
+import os
+import shutil
+import tempfile
+import xlsxwriter
+from utils.schema import to_display, validate_recon
+
+SHEETS = [
+    ("Reconciliation", "recon_df", "reconciliation results"),
+    ("EDW", "edw_df", "EDW data"),
+    ("Journal", "journal_df", "Journal data"),
+    ("Resolution Suggestions", "suggestions_df", "resolution suggestions"),
+]
+
+class ReportFile(io.BufferedReader):
+    """The written report, opened for reading. A report written to a
+    temporary directory takes that directory with it when it is closed
+    (or garbage collected)."""
+
+    def __init__(self, path, temp_dir=None):
+        super().__init__(io.FileIO(path, "rb"))
+        self._temp_dir = temp_dir
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            if self._temp_dir is not None:
+                shutil.rmtree(self._temp_dir, ignore_errors=True)
+                self._temp_dir = None
+
 
 class ReportGeneratorAgent(BaseAgent):
     def run(self, input_data, sop_context=None):
+        return self.write((key, input_data.get(key)) for _, key, _ in SHEETS)
+
+    def write(self, frames):
+        """Write the report from ``(key, df)`` pairs as they become available.
+
+        Keys are those of ``run``'s input. The Reconciliation sheet is always
+        first; the other sheets follow in the order their frames arrive, so
+        raw data can be written while the reconciliation is still running.
+
+        Returns the report as an open :class:`ReportFile` for the caller to
+        close. Without a ``report_dir`` the report goes to a temporary
+        directory that is removed when the file is closed, so sidecar files
+        and linked raw sheets, which must outlive it, need a ``report_dir``.
+        """
         self.log("Generating final Excel report.")
 
+        raw_mode = self.llm_config.get("report_raw_sheets", "include")
+        sidecar_format = self.llm_config.get("report_sidecar_format")
+        if raw_mode == "link" and not sidecar_format:
+            # Linked raw sheets need files to link to
+            sidecar_format = "csv"
+        report_dir = self.llm_config.get("report_dir")
+        if sidecar_format and not report_dir:
+            raise ValueError("Sidecar files and linked raw sheets need report_dir to be set")
+        chunk_rows = self.llm_config.get("report_chunk_rows", 10_000)
+        sheets = {key: (sheet_name, label) for sheet_name, key, label in SHEETS}
+        if raw_mode != "include":
+            del sheets["edw_df"], sheets["journal_df"]
+
+        temp_dir = None if report_dir else tempfile.mkdtemp(prefix="recon_report_")
         try:
-            buffer = BytesIO()
-            with pd.ExcelWriter(buffer, engine="xlsxwriter") as writer:
-                # Write reconciliation results
-                if "recon_df" in input_data and not input_data["recon_df"].empty:
-                    input_data["recon_df"].to_excel(writer, sheet_name="Reconciliation", index=False)
-                    self.log("Added reconciliation results.")
-
-                # Write EDW data
-                if "edw_df" in input_data and not input_data["edw_df"].empty:
-                    input_data["edw_df"].to_excel(writer, sheet_name="EDW", index=False)
-                    self.log("Added EDW data.")
-
-                # Write Journal data
-                if "journal_df" in input_data and not input_data["journal_df"].empty:
-                    input_data["journal_df"].to_excel(writer, sheet_name="Journal", index=False)
-                    self.log("Added Journal data.")
-
-                # Write resolution suggestions if available
-                if (
-                    "suggestions_df" in input_data
-                    and input_data["suggestions_df"] is not None
-                    and not input_data["suggestions_df"].empty
-                ):
-                    input_data["suggestions_df"].to_excel(writer, sheet_name="Resolution Suggestions", index=False)
-                    self.log("Added resolution suggestions.")
-
-            buffer.seek(0)
+            report_dir = report_dir or temp_dir
+            os.makedirs(report_dir, exist_ok=True)
+            report_path = os.path.join(report_dir, "Final_Reconciliation_Report.xlsx")
+
+            # constant_memory flushes each row to a temp file as it is written,
+            # so peak memory stays at one row per sheet instead of the whole report
+            workbook = xlsxwriter.Workbook(
+                report_path,
+                {
+                    "constant_memory": True,
+                    "default_date_format": "yyyy-mm-dd",
+                    "nan_inf_to_errors": True,
+                    "strings_to_urls": False,
+                },
+            )
+            try:
+                # Created up front so it stays the first sheet whatever arrives first
+                recon_sheet = workbook.add_worksheet("Reconciliation")
+                input_data = {}
+                for key, df in frames:
+                    input_data[key] = df
+                    if key == "recon_df" and df is not None:
+                        validate_recon(df)
+                    if key not in sheets or df is None or (df.empty and key != "recon_df"):
+                        continue
+                    sheet_name, label = sheets[key]
+                    worksheet = recon_sheet if key == "recon_df" else workbook.add_worksheet(sheet_name)
+                    with self.stage(f"write {sheet_name}", rows_in=len(df)):
+                        self._write_sheet(worksheet, df, chunk_rows)
+                    self.log(f"Added {label}.")
+
+                sidecar_files = {}
+                if sidecar_format:
+                    sidecar_files = self._write_sidecars(input_data, report_dir, sidecar_format)
+                    self.log(f"Wrote {len(sidecar_files)} {sidecar_format} file(s) alongside the report.")
+                if raw_mode == "link":
+                    self._write_links(workbook, sidecar_files)
+                    self.log("Linked raw EDW and Journal data.")
+                if self.llm_config.get("report_metrics_sheet", True) and self.metrics.stages:
+                    # Stages finished so far; the JSON export also has the rest
+                    self._write_sheet(workbook.add_worksheet("Run Metrics"), self.metrics.to_frame(), chunk_rows)
+                    self.log("Added run metrics.")
+            finally:
+                with self.stage("close workbook"):
+                    workbook.close()
+
             self.log("Excel file generated successfully.")
-            return {"excel_file": buffer}
+            return {
+                "excel_file": ReportFile(report_path, temp_dir),
+                "report_path": report_path,
+                "sidecar_files": sidecar_files,
+            }
 
         except Exception as e:
             self.log(f"Error generating report: {e}")
+            if temp_dir is not None:
+                shutil.rmtree(temp_dir, ignore_errors=True)
             raise
+
+    def _write_sheet(self, worksheet, df, chunk_rows):
+        worksheet.write_row(0, 0, [str(col) for col in df.columns])
+        row = 1
+        for start in range(0, len(df), chunk_rows):
+            # object dtype hands xlsxwriter plain Python values; blanks are skipped
+            chunk = to_display(df.iloc[start:start + chunk_rows]).astype(object)
+            chunk = chunk.where(chunk.notna(), None)
+            for values in chunk.itertuples(index=False, name=None):
+                for col, value in enumerate(values):
+                    if value is not None:
+                        worksheet.write(row, col, value)
+                row += 1
+
+    def _write_sidecars(self, input_data, report_dir, sidecar_format):
+        files = {}
+        for key, stem in (
+            ("recon_df", "Reconciliation"),
+            ("edw_df", "EDW"),
+            ("journal_df", "Journal"),
+            ("suggestions_df", "Resolution_Suggestions"),
+        ):
+            df = input_data.get(key)
+            if df is None or df.empty:
+                continue
+            df = to_display(df)
+            path = os.path.join(report_dir, f"{stem}.{sidecar_format}")
+            if sidecar_format == "parquet":
+                # Mixed object columns (e.g. parsed GPT output) need a uniform type
+                df.astype({c: "string" for c in df.columns if df[c].dtype == object}).to_parquet(path, index=False)
+            else:
+                df.to_csv(path, index=False)
+            files[stem] = path
+        return files
+
+    def _write_links(self, workbook, sidecar_files):
+        worksheet = workbook.add_worksheet("Source Data")
+        worksheet.write_row(0, 0, ["Sheet", "File"])
+        row = 1
+        for stem in ("EDW", "Journal"):
+            if stem in sidecar_files:
+                worksheet.write(row, 0, stem)
+                # Relative to the workbook, so the link survives moving the directory
+                name = os.path.basename(sidecar_files[stem])
+                worksheet.write_url(row, 1, "external:" + name, string=name)
+                row += 1
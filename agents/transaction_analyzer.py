@@ -1,26 +1,200 @@
 # agents/transaction_analyzer.py
 from .base import BaseAgent
 import pandas as pd
-from openai import AzureOpenAI
-from io import StringIO
-import re
+from utils.batching import pair_blocks
+from utils.csv_stream import stream_csv_tables
+from utils.llm_cache import cache_from_config
+from utils.matching import exact_match, tolerance_match, split_match, unmatched_rows, concat_rows, number_rows
+from utils.prompt_codec import PromptCodec, to_prompt_csv
+from utils.schema import FINGERPRINT_COLUMN, RECON_COLUMNS, normalize_recon, normalize_source, source_reference
+from utils.sop_index import relevant_sop
 
 class TransactionAnalyzerAgent(BaseAgent):
-    def run(self, input_data, sop_context=None):
-        edw_df = input_data["edw_df"]
-        journal_df = input_data["journal_df"]
+    def run(self, input_data, sop_context=None, on_unmatched=None):
+        """Reconcile EDW against Journal.
+
+        With ``on_unmatched(recon_df)``, rows that are not MATCHED are handed
+        over as soon as they are final: the deterministic leftovers first,
+        then each GPT block as its response completes, numbered in that
+        order. The returned ``recon_df`` still lists GPT blocks in prompt
+        order, and ``renumbered`` maps the ``No`` a handed-over row had to the
+        one it ended up with, where they differ.
+        """
+        edw_df = normalize_source(input_data["edw_df"], "EDW")
+        journal_df = normalize_source(input_data["journal_df"], "Journal")
         
         if sop_context and sop_context.strip():
             self.log("Using provided SOP for transaction analysis.")
             self.log(f"SOP length: {len(sop_context.split())} words")
+            if len(sop_context.split()) > self.llm_config.get("sop_full_max_words", 1500):
+                self.log("Long SOP: each prompt gets only its most relevant sections.")
         else:
             self.log("No SOP provided, using default reconciliation rules.")
         
-        self.log("Preparing data for GPT prompt.")
-        edw_csv = edw_df.to_csv(index=False)
-        journal_csv = journal_df.to_csv(index=False)
+        with self.stage("deterministic matching", rows_in=len(edw_df) + len(journal_df)) as stage:
+            # Pair the trivially exact rows locally so only the leftovers go to GPT
+            matched_df, edw_df, journal_df = exact_match(edw_df, journal_df)
+            self.log(f"Pre-matched {len(matched_df) // 2} exact pairs without GPT.")
+
+            # Then the date/amount drift the default rules allow for
+            window_df, edw_df, journal_df = tolerance_match(
+                edw_df,
+                journal_df,
+                date_window_days=self.llm_config.get("date_window_days", 3),
+                amount_tolerance=self.llm_config.get("amount_tolerance", 0.0),
+                relative_tolerance=self.llm_config.get("relative_amount_tolerance", 0.0),
+                start_group=len(matched_df) // 2 + 1,
+            )
+            self.log(f"Paired {len(window_df) // 2} rows within the date/amount tolerance window.")
+            matched_df = concat_rows(matched_df, window_df)
+
+            # Then split and combined entries (one Journal to many EDW and back)
+            split_df, edw_df, journal_df = split_match(
+                edw_df,
+                journal_df,
+                date_window_days=self.llm_config.get("date_window_days", 3),
+                amount_tolerance=self.llm_config.get("amount_tolerance", 0.0),
+                max_group_size=self.llm_config.get("max_group_size", 4),
+                time_budget=self.llm_config.get("split_time_budget", 5.0),
+                start_group=len(matched_df) // 2 + 1,
+            )
+            self.log(f"Linked {split_df['Ref 1'].nunique()} split/combined groups ({len(split_df)} rows).")
+            matched_df = concat_rows(matched_df, split_df)
+            stage["rows_out"] = len(matched_df)
+
+        self.log(f"Remaining for GPT: {len(edw_df)} EDW rows, {len(journal_df)} Journal rows.")
+
+        emitted = [0]
+
+        def emit(recon_part):
+            # Number the rows as they will appear in the final frame
+            recon_part = recon_part.set_axis(range(emitted[0], emitted[0] + len(recon_part)))
+            recon_part["No"] = recon_part.index + 1
+            emitted[0] += len(recon_part)
+            if on_unmatched is not None:
+                unmatched_df = recon_part[recon_part["Status"] != "MATCHED"]
+                if not unmatched_df.empty:
+                    on_unmatched(unmatched_df)
+            return recon_part
+
+        matched_df = emit(matched_df)
+        if edw_df.empty and journal_df.empty:
+            self.log("All transactions matched deterministically, skipping GPT.")
+            return {"recon_df": number_rows(matched_df)}
+
+        # Nothing left on one side means nothing left to pair against
+        if edw_df.empty or journal_df.empty:
+            side, leftover_df = ("Journal", journal_df) if edw_df.empty else ("EDW", edw_df)
+            leftover_recon = unmatched_rows(leftover_df, side)
+            if leftover_recon is not None:
+                self.log(f"No counterpart rows left, marking {len(leftover_recon)} {side} rows UNMATCHED.")
+                return {"recon_df": number_rows(concat_rows(matched_df, emit(normalize_recon(leftover_recon))))}
+
+        # Send only the matching columns, with short codes and row IDs
+        with self.stage("prompt building", rows_in=len(edw_df) + len(journal_df)) as stage:
+            codec = PromptCodec()
+            # Codes must agree across sides, as blocks are grouped by them
+            codec.learn_codes((edw_df, "EDW"), (journal_df, "Journal"))
+            edw_compact = codec.compact(edw_df, "EDW")
+            journal_compact = codec.compact(journal_df, "Journal")
+            blocks = pair_blocks(edw_compact, journal_compact, self.llm_config.get("block_token_budget", 8000))
+            self.log(f"Preparing {len(blocks)} GPT prompt block(s).")
+            prompts = [
+                self._build_prompt(
+                    edw_block,
+                    journal_block,
+                    codec.legend(edw_block, journal_block),
+                    self._block_sop(sop_context, codec, edw_block, journal_block),
+                )
+                for edw_block, journal_block in blocks
+            ]
+            self.check_prompt_budget(prompts)
+            stage["prompts"] = len(prompts)
+        frames = {"EDW": edw_df, "Journal": journal_df}
 
-        prompt = f"""
+        def fingerprint(side, index):
+            # Incremental runs track each source row by the fingerprint in Ref 3
+            if FINGERPRINT_COLUMN not in frames[side].columns:
+                return {}
+            return {"Ref 3": frames[side].at[index, FINGERPRINT_COLUMN]}
+
+        def decode(records):
+            # Row IDs in Ref 2 become the source references again
+            return codec.decode_records(
+                records, "Ref 2", lambda side, index: source_reference(frames[side], side, index), fingerprint
+            )
+
+        def to_recon(records):
+            # Types and Status values are standardized by the shared schema
+            return normalize_recon(pd.DataFrame(decode(records), columns=RECON_COLUMNS))
+
+        # Filled in completion order, which is the order rows are first numbered in
+        block_frames = {}
+        renumbered = {}
+
+        def on_block(index, records):
+            block_frames[index] = emit(to_recon(records))
+
+        try:
+            cache = cache_from_config(self.llm_config)
+            # Rows are parsed as they stream in, so partial results can be shown
+            with self.stage("gpt matching", prompts=len(prompts)) as stage:
+                records, repaired, dropped = stream_csv_tables(
+                    self.llm_config,
+                    prompts,
+                    RECON_COLUMNS,
+                    cache,
+                    on_records=lambda rows: self.progress(
+                        number_rows(concat_rows(matched_df, to_recon(rows)))
+                    ),
+                    stats=self.metrics.llm,
+                    on_block=on_block if on_unmatched is not None else None,
+                )
+                stage.update(rows_out=len(records), repaired_rows=repaired, dropped_rows=len(dropped))
+            if cache is not None:
+                self.log(f"Response cache: {cache.stats()}.")
+            self.log(f"Received {len(prompts)} response(s) from GPT.")
+            if repaired:
+                self.log(f"Recovered {repaired} malformed row(s) with a follow-up request.")
+            if dropped:
+                self.log(f"Dropped {len(dropped)} row(s) GPT could not return in the expected format.")
+
+            if on_unmatched is not None:
+                # Rows the follow-up request recovered come after every block
+                block_rows = sum(len(frame) for frame in block_frames.values())
+                extra_df = emit(to_recon(records[block_rows:]))
+                recon_df = concat_rows(matched_df, *(block_frames[i] for i in sorted(block_frames)), extra_df)
+                handed_over = recon_df["No"].to_numpy()
+                recon_df = number_rows(recon_df)
+                renumbered = {
+                    int(old): int(new) for old, new in zip(handed_over, recon_df["No"]) if old != new
+                }
+            else:
+                recon_df = number_rows(concat_rows(matched_df, to_recon(records)))
+
+            self.log("Successfully parsed GPT response to DataFrame.")
+
+        except Exception as e:
+            self.log(f"Error in transaction analysis: {e}")
+            raise
+
+        return {"recon_df": recon_df, "renumbered": renumbered}
+
+    def _block_sop(self, sop_context, codec, *blocks):
+        # Long SOPs are cut down to the sections about this block's Tran Codes
+        query = " ".join(codec.distinct_values(blocks, "Tran Code"))
+        return relevant_sop(
+            sop_context,
+            f"{query} match reconcile transaction code date amount debit partial",
+            max_words=self.llm_config.get("sop_full_max_words", 1500),
+            k=self.llm_config.get("sop_top_k", 5),
+        )
+
+    def _build_prompt(self, edw_df, journal_df, legend, sop_context):
+        edw_csv = to_prompt_csv(edw_df)
+        journal_csv = to_prompt_csv(journal_df)
+
+        return f"""
 You are a highly precise finance assistant. Your job is to match Journal and EDW transactions for reconciliation.
 
 **Instructions:**
@@ -30,6 +204,8 @@ No,Item Type,Reconciliation,SIDE,Value Date,Ref 1,Amount,Amt CCY,Bus Entity,Stmt
 - If a field contains a comma, wrap it in double quotes.
 - Do NOT add any explanations, markdown, code blocks, summary lines, or extra headers.
 - Every row must have exactly 17 columns, matching the header above.
+- Each input row starts with an id. Put the id of the EDW or Journal row an output row describes in its Ref 2 column.
+- Values starting with # are codes explained in the legend; you may use them as-is.
 
 **Status column values:**
 - Use ONLY: MATCHED, UNMATCHED, or PARTIAL.
@@ -37,6 +213,9 @@ No,Item Type,Reconciliation,SIDE,Value Date,Ref 1,Amount,Amt CCY,Bus Entity,Stmt
 **SOP:**
 {sop_context or 'No SOP provided. Use standard reconciliation rules: 1. Match transactions based on Account Number, Transaction Code, and Date. 2. Compare amounts ensuring Debit matches sum of absolute EDW amounts. 3. Flag partial matches when amounts do not fully reconcile.'}
 
+**Legend:**
+{legend}
+
 **EDW:**
 {edw_csv}
 
@@ -45,57 +224,3 @@ No,Item Type,Reconciliation,SIDE,Value Date,Ref 1,Amount,Amt CCY,Bus Entity,Stmt
 
 Remember: Output ONLY the CSV data, with the exact columns and order specified above. No extra text, explanations, or formatting.
 """
-
-        try:
-            # Use AzureOpenAI client
-            client = AzureOpenAI(
-                api_key=self.llm_config.get("api_key"),
-                api_version=self.llm_config.get("api_version"),
-                azure_endpoint=self.llm_config.get("azure_endpoint")
-            )
-            response = client.chat.completions.create(
-                model=self.llm_config.get("model_name"),
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0
-            )
-            content = response.choices[0].message.content
-            gpt_output = content.strip() if content else ""
-            self.log("Received response from GPT.")
-
-            # Clean up the output
-            # Remove any markdown code block syntax
-            gpt_output = re.sub(r'```\w*\n?', '', gpt_output)
-            gpt_output = gpt_output.strip()
-
-            # Ensure we have the header
-            expected_header = "No,Item Type,Reconciliation,SIDE,Value Date,Ref 1,Amount,Amt CCY,Bus Entity,Stmt Date,Rule,ENTRY DATE,Ref 2,Ref 3,Ref 4,Tran Code,Status"
-            if not gpt_output.startswith(expected_header):
-                gpt_output = expected_header + "\n" + gpt_output
-
-            lines = gpt_output.split('\n')
-            cleaned_lines = []
-            num_columns = len(expected_header.split(','))
-            
-            for line in lines:
-                if line.strip():  # Skip empty lines
-                    fields = line.split(',')
-                    if len(fields) > num_columns:
-                        # If we have too many columns, combine excess columns
-                        fields = fields[:num_columns-1] + [','.join(fields[num_columns-1:])]
-                    elif len(fields) < num_columns:
-                        # If we have too few columns, pad with empty strings
-                        fields.extend([''] * (num_columns - len(fields)))
-                    cleaned_lines.append(','.join(fields))
-            
-            cleaned_csv = '\n'.join(cleaned_lines)
-            recon_df = pd.read_csv(StringIO(cleaned_csv))
-            # Ensure Status column is string and standardized
-            recon_df['Status'] = recon_df['Status'].fillna('UNMATCHED').astype(str).str.upper()
-
-            self.log("Successfully parsed GPT response to DataFrame.")
-
-        except Exception as e:
-            self.log(f"Error in transaction analysis: {e}")
-            raise
-
-        return {"recon_df": recon_df}
@@ -1,7 +1,8 @@
 # app.py
 import streamlit as st
-from agents.orchestrator import AgentOrchestrator
-from utils.pdf_parser import extract_text_from_pdf
+import pandas as pd
+from job_queue import DONE, JobQueue, report_cache_from_config
+from utils.schema import to_display
 import os
 from dotenv import load_dotenv
 
@@ -11,6 +12,67 @@ load_dotenv()
 # --- Page Config ---
 st.set_page_config(page_title="Bank Reconciliation AI (Agents)", layout="centered")
 
+@st.cache_resource
+def get_job_queue():
+    # One queue per server, shared by every session
+    return JobQueue(
+        max_workers=int(os.getenv("RECON_JOB_WORKERS", "2")),
+        cache=report_cache_from_config({}),
+    )
+
+
+@st.fragment(run_every=1.0)
+def show_progress(job_id):
+    job = get_job_queue().get(job_id)
+    if job is None or job.done:
+        # A full rerun shows the result
+        st.rerun()
+    finished, running = job.progress()
+    if job.status == "queued":
+        st.info(f"⏳ Job {job.id} is queued behind other reconciliations...")
+    else:
+        st.info(f"🧠 Job {job.id}: {', '.join(running) or 'starting'}...")
+    if finished:
+        st.dataframe(pd.DataFrame(finished)[["stage", "wall_s"]], use_container_width=True, hide_index=True)
+    if job.partial is not None:
+        # Rows parsed so far from the streamed GPT responses
+        agent_name, partial_df = job.partial
+        st.caption(f"{agent_name}: {len(partial_df)} rows so far")
+        st.dataframe(to_display(partial_df).tail(200), use_container_width=True)
+
+
+def show_result(job):
+    if job.status == DONE:
+        st.success("✅ Reconciliation completed." + (" (Same files as an earlier run, cached report.)" if job.cached else ""))
+    else:
+        st.error("❌ Failed during agent execution.")
+        st.code(job.error)
+
+    # Show Logs
+    with st.expander("📝 Agent Logs", expanded=True):
+        for log in job.logs:
+            st.write(log)
+
+    if job.metrics:
+        with st.expander("📊 Run Metrics"):
+            st.dataframe(job.metrics_frame(), use_container_width=True)
+
+    # Download Output
+    if job.status == DONE:
+        try:
+            report = job.open_report()
+        except FileNotFoundError:
+            st.warning("⚠️ This report has expired from the cache. Please run the reconciliation again.")
+            return
+        with report:
+            st.download_button(
+                label="📥 Download Final Reconciliation Report",
+                data=report,
+                file_name="Final_Reconciliation_Report.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
+
+
 # Initialize the consent state in session state if it doesn't exist
 if 'consent_given' not in st.session_state:
     st.session_state.consent_given = False
@@ -26,7 +88,8 @@ if not st.session_state.consent_given:
     - This application processes Excel files and SOP documents
     - We use external services including OpenAI's LLM for data processing
     - DO NOT upload files containing sensitive, confidential, or real customer data
-    - All data processing is done in-memory and not stored permanently
+    - GPT responses and extracted SOP text are cached on the server to speed up re-runs; both are evicted after 30 days
+    - Finished reports are cached on the server so re-uploading the same files returns them instantly; they are evicted after 7 days
     """)
     
     consent = st.checkbox("I understand and confirm that I will not upload any sensitive or real customer data")
@@ -65,18 +128,10 @@ else:
 
     uploaded_file = st.file_uploader("📂 Upload Excel file", type=["xlsx"])
 
-    # Check if PDF parsing is available
-    try:
-        from utils.pdf_parser import extract_text_from_pdf
-        sop_file = st.file_uploader("📘 Upload SOP / Policy PDF (optional)", type=["pdf"])
-    except ImportError:
-        st.warning("📘 PDF parsing is not available. SOP upload is disabled.")
-        sop_file = None
+    sop_file = st.file_uploader("📘 Upload SOP / Policy PDF (optional)", type=["pdf"])
 
     # --- Process Button ---
     if uploaded_file and st.button("🚀 Run Reconciliation"):
-        logs = []
-
         # 1. Get Azure OpenAI credentials
         def get_azure_openai_config():
             # Try environment variables first
@@ -107,40 +162,21 @@ else:
 
         azure_config = get_azure_openai_config()
 
-        # 2. Extract SOP text
-        sop_text = ""
-        if sop_file:
-            with st.spinner("📖 Reading SOP PDF..."):
-                try:
-                    sop_text = extract_text_from_pdf(sop_file)
-                    if sop_text:
-                        st.success("✅ SOP loaded successfully.")
-                    else:
-                        st.warning("⚠️ Could not read SOP. Proceeding without SOP context.")
-                except Exception as e:
-                    st.warning(f"⚠️ Could not read SOP: {e}")
-
-        # 3. Run Orchestration
-        st.info("⏳ Running all agents...")
-        with st.spinner("🧠 Reconciliation in progress..."):
-            try:
-                orchestrator = AgentOrchestrator(azure_config)
-                output_file, logs = orchestrator.run_all(uploaded_file, sop_text)
-                st.success("✅ Reconciliation completed.")
-            except Exception as e:
-                st.error("❌ Failed during agent execution.")
-                st.exception(e)
-                st.stop()
-
-        # 4. Show Logs
-        with st.expander("📝 Agent Logs", expanded=True):
-            for log in logs:
-                st.write(log)
-
-        # 5. Download Output
-        st.download_button(
-            label="📥 Download Final Reconciliation Report",
-            data=output_file,
-            file_name="Final_Reconciliation_Report.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        # 2. Queue the run; the SOP is read by the worker
+        job = get_job_queue().submit(
+            uploaded_file.getvalue(), sop_file.getvalue() if sop_file else None, azure_config
         )
+        # The job ID in the URL survives browser reloads
+        st.session_state.job_id = job.id
+        st.query_params["job"] = job.id
+
+    # 3. Follow the current job
+    job_id = st.session_state.get("job_id") or st.query_params.get("job")
+    if job_id:
+        job = get_job_queue().get(job_id)
+        if job is None:
+            st.warning("⚠️ This reconciliation job is no longer available. Please run it again.")
+        elif not job.done:
+            show_progress(job.id)
+        else:
+            show_result(job)
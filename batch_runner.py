@@ -0,0 +1,208 @@
+# batch_runner.py
+"""Headless batch reconciliation of many workbooks.
+
+    python batch_runner.py INPUT --output-dir reports [--sop policy.pdf] [--workers 4]
+
+INPUT is a directory of workbooks (``.xlsx`` files, or folders holding an
+EDW/Journal CSV or Parquet pair) or a CSV/JSON manifest with ``workbook`` and
+optional ``sop`` and ``name`` columns. A workbook without its own SOP uses a
+PDF with the same name next to it, else ``--sop``.
+
+Workbooks run in a process pool. GPT calls in flight are capped across all
+workers, and the per-minute quotas are split evenly between them. Each
+workbook gets its own folder with the report and a ``run.log``; a
+``summary.csv`` / ``summary.json`` index lists the outcome of every file.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from agents.orchestrator import AgentOrchestrator
+from utils import llm
+from utils.ingest import SHEETS
+from utils.pdf_parser import extract_text_from_pdf
+
+SUMMARY_COLUMNS = [
+    "name", "workbook", "sop", "status", "report", "rows", "matched", "partial", "unmatched",
+    "seconds", "error",
+]
+
+
+def _is_table_folder(path):
+    stems = {os.path.splitext(name)[0] for name in os.listdir(path)}
+    return all(sheet in stems for sheet in SHEETS)
+
+
+def _job(workbook, sop=None, name=None):
+    stem = os.path.splitext(os.path.basename(os.path.normpath(workbook)))[0]
+    if sop is None:
+        sibling = os.path.splitext(os.path.normpath(workbook))[0] + ".pdf"
+        sop = sibling if os.path.isfile(sibling) else None
+    return {"name": name or stem, "workbook": workbook, "sop": sop}
+
+
+def discover_jobs(source, default_sop=None):
+    """Return one job dict (``name``, ``workbook``, ``sop``) per workbook in
+    a directory or manifest, in a stable order."""
+    if os.path.isdir(source):
+        jobs = []
+        for entry in sorted(os.listdir(source)):
+            path = os.path.join(source, entry)
+            if entry.startswith((".", "~$")):
+                continue
+            if entry.lower().endswith(".xlsx") or (os.path.isdir(path) and _is_table_folder(path)):
+                jobs.append(_job(path))
+    else:
+        base = os.path.dirname(os.path.abspath(source))
+        if source.lower().endswith(".json"):
+            with open(source, encoding="utf-8") as f:
+                entries = json.load(f)
+        else:
+            entries = pd.read_csv(source, dtype=str).to_dict("records")
+        jobs = []
+        for entry in entries:
+            entry = {key: value for key, value in entry.items() if isinstance(value, str) and value.strip()}
+            if "workbook" not in entry:
+                raise ValueError(f"Manifest entry without a workbook: {entry}")
+            sop = entry.get("sop")
+            jobs.append(_job(
+                os.path.join(base, entry["workbook"]),
+                os.path.join(base, sop) if sop else None,
+                entry.get("name"),
+            ))
+
+    for job in jobs:
+        job["sop"] = job["sop"] or default_sop
+    # Reports go to one folder per name, so names must be unique
+    counts = {}
+    for job in jobs:
+        counts[job["name"]] = counts.get(job["name"], 0) + 1
+        if counts[job["name"]] > 1:
+            job["name"] = f"{job['name']}_{counts[job['name']]}"
+    return jobs
+
+
+def _run_job(job, sop_text, llm_config, output_dir):
+    """Reconcile one workbook in a worker process and return its summary row."""
+    started = time.perf_counter()
+    job_dir = os.path.join(output_dir, job["name"])
+    os.makedirs(job_dir, exist_ok=True)
+    orchestrator = AgentOrchestrator({**llm_config, "report_dir": job_dir})
+    summary = {**job, "status": "ok", "report": "", "rows": 0, "matched": 0, "partial": 0, "unmatched": 0, "error": ""}
+    try:
+        excel_file, _ = orchestrator.run_all(job["workbook"], sop_text)
+        excel_file.close()
+        statuses = orchestrator.recon_df["Status"].value_counts()
+        summary.update(
+            report=orchestrator.report_path,
+            rows=len(orchestrator.recon_df),
+            matched=int(statuses.get("MATCHED", 0)),
+            partial=int(statuses.get("PARTIAL", 0)),
+            unmatched=int(statuses.get("UNMATCHED", 0)),
+        )
+    except Exception as e:
+        summary.update(status="failed", error=f"{type(e).__name__}: {e}")
+        orchestrator.logs.append(traceback.format_exc())
+    summary["seconds"] = round(time.perf_counter() - started, 2)
+    with open(os.path.join(job_dir, "run.log"), "w", encoding="utf-8") as f:
+        f.write("\n".join(orchestrator.logs) + "\n")
+    return summary
+
+
+def run_batch(jobs, llm_config, output_dir, workers=None, max_llm_calls=None, on_result=None):
+    """Reconcile ``jobs`` (see :func:`discover_jobs`) in a process pool.
+
+    ``max_llm_calls`` caps GPT calls in flight across all workers (default:
+    ``max_concurrency`` from the config). ``on_result(summary)`` is called as
+    each workbook finishes. Writes ``summary.csv`` and ``summary.json`` to
+    ``output_dir`` and returns the summary rows in job order.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs) or 1))
+
+    # Every SOP is read once here rather than once per workbook
+    sop_texts = {}
+    for sop in {job["sop"] for job in jobs if job["sop"]}:
+        with open(sop, "rb") as f:
+            sop_texts[sop] = extract_text_from_pdf(f)
+
+    summaries = {}
+    with multiprocessing.Manager() as manager:
+        slots = manager.BoundedSemaphore(max_llm_calls or llm_config.get("max_concurrency", 4))
+        config = llm.share_quota(llm_config, workers)
+        with ProcessPoolExecutor(max_workers=workers, initializer=llm.set_shared_slots, initargs=(slots,)) as pool:
+            futures = {
+                pool.submit(_run_job, job, sop_texts.get(job["sop"], ""), config, output_dir): n
+                for n, job in enumerate(jobs)
+            }
+            for future in as_completed(futures):
+                summary = future.result()
+                summaries[futures[future]] = summary
+                if on_result is not None:
+                    on_result(summary)
+
+    rows = [summaries[n] for n in range(len(jobs))]
+    index = pd.DataFrame(rows, columns=SUMMARY_COLUMNS)
+    index.to_csv(os.path.join(output_dir, "summary.csv"), index=False)
+    with open(os.path.join(output_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(rows, f, indent=2, default=str)
+    return rows
+
+
+def config_from_env():
+    """Azure OpenAI credentials from the same environment variables the app reads."""
+    return {
+        "azure_endpoint": os.getenv("AZURE_OPENAI_ENDPOINT"),
+        "api_key": os.getenv("AZURE_OPENAI_API_KEY"),
+        "api_version": os.getenv("OPENAI_API_VERSION"),
+        "model_name": os.getenv("AZURE_OPENAI_MODEL_NAME"),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reconcile a batch of EDW/Journal workbooks.")
+    parser.add_argument("input", help="directory of workbooks, or a CSV/JSON manifest")
+    parser.add_argument("--output-dir", default="reports", help="where reports and the summary go")
+    parser.add_argument("--sop", help="SOP PDF for workbooks without their own")
+    parser.add_argument("--workers", type=int, help="workbooks processed in parallel (default: CPU count)")
+    parser.add_argument("--max-llm-calls", type=int, help="GPT calls in flight across all workers")
+    parser.add_argument("--config", help="JSON file of agent options (see the readme)")
+    args = parser.parse_args(argv)
+
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+    llm_config = config_from_env()
+    if args.config:
+        with open(args.config, encoding="utf-8") as f:
+            llm_config.update(json.load(f))
+    missing = [key for key in ("azure_endpoint", "api_key", "api_version", "model_name") if not llm_config.get(key)]
+    if missing:
+        parser.error(f"Azure OpenAI settings missing: {', '.join(missing)}")
+
+    jobs = discover_jobs(args.input, args.sop)
+    if not jobs:
+        parser.error(f"No workbooks found in {args.input}")
+    print(f"Reconciling {len(jobs)} workbook(s)...", file=sys.stderr)
+
+    def report(summary):
+        detail = summary["report"] if summary["status"] == "ok" else summary["error"]
+        print(f"[{summary['status']}] {summary['name']} ({summary['seconds']}s): {detail}", file=sys.stderr)
+
+    rows = run_batch(jobs, llm_config, args.output_dir, args.workers, args.max_llm_calls, report)
+    failed = sum(row["status"] != "ok" for row in rows)
+    print(f"Done: {len(rows) - failed} ok, {failed} failed. Summary in {args.output_dir}/summary.csv", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
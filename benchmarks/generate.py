@@ -0,0 +1,146 @@
+# benchmarks/generate.py
+"""Synthetic EDW/Journal inputs with controlled mismatches.
+
+Every EDW transaction has a Journal counterpart unless a mismatch is injected:
+
+- date drift: the Journal date moves 1-3 days (inside the default window),
+- splits: the EDW side is booked as 2-3 parts of one Journal entry,
+- reversals: an EDW entry is reversed the next day and never reaches the Journal,
+- FX differences: the Journal amount is off by up to 0.4% (conversion rate),
+- orphans: a Journal entry with no EDW counterpart.
+
+    python -m benchmarks.generate 100000 --output bench.xlsx
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_MISMATCHES = {
+    "date_drift": 0.10,
+    "splits": 0.05,
+    "reversals": 0.02,
+    "fx": 0.03,
+    "orphans": 0.02,
+}
+
+
+def generate(n_rows, seed=0, mismatches=None, accounts=50, entities=5):
+    """Return ``(edw_df, journal_df, injected)`` with about ``n_rows`` base
+    transactions; ``injected`` counts the rows given each kind of mismatch."""
+    rates = {**DEFAULT_MISMATCHES, **(mismatches or {})}
+    rng = np.random.default_rng(seed)
+    n = int(n_rows)
+
+    account = rng.integers(0, accounts, n)
+    base = pd.DataFrame({
+        "account": np.char.add("ACCT", account.astype(str).astype("<U8")),
+        "tran_code": rng.choice(["TC100", "TC200", "TC300", "TC400"], n),
+        "date": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 28, n), unit="D"),
+        "cents": rng.integers(100, 5_000_000, n),
+        "entity": np.char.add("BE", (account % entities).astype(str).astype("<U4")),
+        "ref": np.char.add("TX", np.arange(n).astype(str).astype("<U12")),
+    })
+    kind = rng.choice(
+        ["clean"] + list(rates),
+        n,
+        p=[1 - sum(rates.values())] + list(rates.values()),
+    )
+
+    # EDW: one row per transaction, except splits (several parts) and reversals (two rows)
+    edw_parts = [base[kind != "splits"].assign(amount=lambda d: -d["cents"])]
+    split = base[kind == "splits"]
+    if len(split):
+        pieces = rng.integers(2, 4, len(split))
+        repeated = split.loc[split.index.repeat(pieces)].copy()
+        weights = rng.random(len(repeated))
+        group = np.repeat(np.arange(len(split)), pieces)
+        share = weights / np.bincount(group, weights)[group]
+        parts = np.floor(share * repeated["cents"].to_numpy()).astype(np.int64)
+        # The last part takes the rounding remainder so the parts add up exactly
+        last = np.cumsum(pieces) - 1
+        parts[last] += split["cents"].to_numpy() - np.bincount(group, parts).astype(np.int64)
+        repeated["amount"] = -parts
+        repeated["ref"] = repeated["ref"] + "-" + (repeated.groupby(level=0).cumcount() + 1).astype(str)
+        edw_parts.append(repeated)
+    reversed_rows = base[kind == "reversals"]
+    if len(reversed_rows):
+        edw_parts.append(reversed_rows.assign(
+            amount=reversed_rows["cents"],
+            date=reversed_rows["date"] + pd.Timedelta(days=1),
+            ref=reversed_rows["ref"] + "-REV",
+        ))
+    edw = pd.concat(edw_parts)
+
+    # Journal: one row per transaction that reached it, plus orphans
+    journal = base[~np.isin(kind, ["reversals", "orphans"])].copy()
+    journal["debit"] = journal["cents"]
+    drift = kind[journal.index] == "date_drift"
+    journal.loc[drift, "date"] += pd.to_timedelta(rng.choice([-3, -2, -1, 1, 2, 3], drift.sum()), unit="D")
+    fx = kind[journal.index] == "fx"
+    journal.loc[fx, "debit"] = np.round(journal.loc[fx, "cents"] * (1 + rng.uniform(-0.004, 0.004, fx.sum())))
+    orphans = base[kind == "orphans"]
+    journal = pd.concat([journal, orphans.assign(debit=rng.integers(100, 5_000_000, len(orphans)))])
+
+    edw_df = pd.DataFrame({
+        "Account Number": edw["account"].to_numpy(),
+        "Tran Code": edw["tran_code"].to_numpy(),
+        "Process Date": edw["date"].to_numpy(),
+        "Amount": edw["amount"].to_numpy() / 100,
+        "Amt CCY": "USD",
+        "Bus Entity": edw["entity"].to_numpy(),
+        "Transaction Ref": edw["ref"].to_numpy(),
+    })
+    journal_df = pd.DataFrame({
+        "Account Number": journal["account"].to_numpy(),
+        "Tran Code": journal["tran_code"].to_numpy(),
+        "Journal Date": journal["date"].to_numpy(),
+        "Debit Amount": journal["debit"].to_numpy() / 100,
+        "Credit Amount": 0.0,
+        "Bus Entity": journal["entity"].to_numpy(),
+    })
+    # Real extracts are not sorted the same way on both sides
+    edw_df = edw_df.sample(frac=1, random_state=seed).reset_index(drop=True)
+    journal_df = journal_df.sample(frac=1, random_state=seed + 1).reset_index(drop=True)
+    injected = {name: int((kind == name).sum()) for name in rates}
+    return edw_df, journal_df, injected
+
+
+def write_input(edw_df, journal_df, path, fmt="xlsx"):
+    """Write the two sheets where the agents can read them: one ``.xlsx``
+    workbook, or a directory with ``EDW`` / ``Journal`` CSV or Parquet files.
+    Returns the path to hand to ``AgentOrchestrator.run_all``."""
+    if fmt == "xlsx":
+        # No constant_memory here: pandas writes cells column by column
+        with pd.ExcelWriter(path, engine="xlsxwriter") as writer:
+            edw_df.to_excel(writer, sheet_name="EDW", index=False)
+            journal_df.to_excel(writer, sheet_name="Journal", index=False)
+        return path
+    os.makedirs(path, exist_ok=True)
+    for name, df in (("EDW", edw_df), ("Journal", journal_df)):
+        target = os.path.join(path, f"{name}.{fmt}")
+        if fmt == "parquet":
+            df.to_parquet(target, index=False)
+        else:
+            df.to_csv(target, index=False)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic EDW/Journal input.")
+    parser.add_argument("rows", type=int, help="base transactions (1k-1M)")
+    parser.add_argument("--output", required=True, help=".xlsx file, or directory for csv/parquet")
+    parser.add_argument("--format", choices=["xlsx", "csv", "parquet"], default="xlsx")
+    parser.add_argument("--seed", type=int, default=0)
+    for name, rate in DEFAULT_MISMATCHES.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=float, default=rate, help=f"share of rows (default {rate})")
+    args = parser.parse_args(argv)
+    rates = {name: getattr(args, name) for name in DEFAULT_MISMATCHES}
+    edw_df, journal_df, injected = generate(args.rows, args.seed, rates)
+    write_input(edw_df, journal_df, args.output, args.format)
+    print(f"Wrote {len(edw_df)} EDW / {len(journal_df)} Journal rows to {args.output}; injected {injected}")
+
+
+if __name__ == "__main__":
+    main()
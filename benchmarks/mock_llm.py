@@ -0,0 +1,165 @@
+# benchmarks/mock_llm.py
+"""Local stand-in for the Azure OpenAI chat-completions endpoint.
+
+Answers every prompt the agents send with a well-formed CSV table: each row ID
+found in the prompt comes back as one UNMATCHED reconciliation row (analyzer
+prompts) or one suggestion (resolver prompts), so the whole pipeline runs
+offline. Latency, streaming throughput and error rates are configurable.
+
+    python -m benchmarks.mock_llm --port 8089 --latency 0.5 --tokens-per-second 200
+
+Point the agents at it with ``azure_endpoint="http://127.0.0.1:8089"`` and any
+key, API version and model name.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.batching import estimate_tokens
+from utils.schema import RECON_COLUMNS
+
+_ROW_ID = re.compile(r"^([EJR]\d+),", re.MULTILINE)
+CHUNK_CHARS = 64
+
+
+def mock_answer(prompt):
+    """The CSV table a cooperative model would return for ``prompt``."""
+    ids = _ROW_ID.findall(prompt)
+    if ",".join(RECON_COLUMNS) in prompt:
+        lines = [",".join(RECON_COLUMNS)]
+        for n, row_id in enumerate(ids, 1):
+            side = "EDW" if row_id.startswith("E") else "Journal"
+            lines.append(f"{n},{side},,,,,,,,,MOCK,,{row_id},,,,UNMATCHED")
+    else:
+        lines = ["Ref 1,Issue,Suggested Resolution"]
+        lines += [f"{row_id},No counterpart found,Review the entry with the account owner" for row_id in ids]
+    return "\n".join(lines)
+
+
+class MockSettings:
+    def __init__(self, latency=0.2, jitter=0.1, tokens_per_second=None, rate_limit_rate=0.0,
+                 server_error_rate=0.0, retry_after=1.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.rate_limit_rate = rate_limit_rate
+        self.server_error_rate = server_error_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def draw(self):
+        with self.lock:
+            self.requests += 1
+            return self.random.random(), self.random.uniform(-self.jitter, self.jitter)
+
+
+def _handler(settings):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _json(self, status, payload, headers=None):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers["content-length"])))
+            roll, jitter = settings.draw()
+            if roll < settings.rate_limit_rate:
+                return self._json(
+                    429, {"error": {"message": "Rate limit reached (mock)"}},
+                    {"retry-after": str(settings.retry_after)},
+                )
+            if roll < settings.rate_limit_rate + settings.server_error_rate:
+                return self._json(500, {"error": {"message": "Internal error (mock)"}})
+
+            prompt = request["messages"][-1]["content"]
+            answer = mock_answer(prompt)
+            time.sleep(max(0.0, settings.latency + jitter))
+            model = request.get("model", "mock")
+            if request.get("stream"):
+                return self._stream(model, answer)
+
+            usage = {
+                "prompt_tokens": estimate_tokens(prompt),
+                "completion_tokens": estimate_tokens(answer),
+                "total_tokens": estimate_tokens(prompt) + estimate_tokens(answer),
+            }
+            self._pace(answer)
+            self._json(200, {
+                "id": "mock", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": answer}}],
+                "usage": usage,
+            })
+
+        def _pace(self, text):
+            if settings.tokens_per_second:
+                time.sleep(estimate_tokens(text) / settings.tokens_per_second)
+
+        def _stream(self, model, answer):
+            # Server-sent events, one chunk per CHUNK_CHARS characters
+            self.send_response(200)
+            self.send_header("content-type", "text/event-stream")
+            self.end_headers()
+            for start in range(0, len(answer), CHUNK_CHARS):
+                piece = answer[start:start + CHUNK_CHARS]
+                self._pace(piece)
+                chunk = {
+                    "id": "mock", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.write(b"data: [DONE]\n\n")
+
+    return Handler
+
+
+def serve(host="127.0.0.1", port=8089, **settings):
+    """Run the mock endpoint until interrupted; ``settings`` are :class:`MockSettings` arguments."""
+    server = ThreadingHTTPServer((host, port), _handler(MockSettings(**settings)))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def start_in_thread(host="127.0.0.1", port=0, **settings):
+    """Start the mock endpoint in a daemon thread; returns ``(url, server)``."""
+    server = ThreadingHTTPServer((host, port), _handler(MockSettings(**settings)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://{host}:{server.server_address[1]}", server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mock Azure OpenAI chat-completions endpoint.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--jitter", type=float, default=0.1, help="± seconds of random latency")
+    parser.add_argument("--tokens-per-second", type=float, help="output throughput per response")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of requests answered 429")
+    parser.add_argument("--server-error-rate", type=float, default=0.0, help="share of requests answered 500")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    args = parser.parse_args(argv)
+    print(f"Mock chat-completions endpoint on http://{args.host}:{args.port}")
+    serve(
+        args.host, args.port, latency=args.latency, jitter=args.jitter,
+        tokens_per_second=args.tokens_per_second, rate_limit_rate=args.rate_limit_rate,
+        server_error_rate=args.server_error_rate, retry_after=args.retry_after,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# benchmarks/run.py
+"""Time every stage of ``AgentOrchestrator.run_all`` at several input sizes.
+
+GPT calls go to the local mock endpoint, so no Azure OpenAI access is needed.
+
+    python -m benchmarks.run --sizes 1000 10000 100000 --output benchmarks/baseline.json
+    python -m benchmarks.run --sizes 1000 10000 --compare benchmarks/baseline.json
+
+``--compare`` prints the wall-time ratio of every stage against an earlier
+result file and exits with 1 if any stage slowed down beyond ``--threshold``.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from agents.orchestrator import AgentOrchestrator
+from benchmarks.generate import DEFAULT_MISMATCHES, generate, write_input
+from benchmarks.mock_llm import start_in_thread
+
+# Sizes above this go through Parquet; writing and reading xlsx would dominate
+XLSX_MAX_ROWS = 100_000
+MIN_COMPARED_SECONDS = 0.05
+
+
+def run_size(n_rows, llm_config, work_dir, fmt=None, seed=0):
+    """Generate an input of ``n_rows`` transactions, reconcile it and return
+    its result record (input sizes, injected mismatches, per-stage metrics)."""
+    fmt = fmt or ("xlsx" if n_rows <= XLSX_MAX_ROWS else "parquet")
+    edw_df, journal_df, injected = generate(n_rows, seed)
+    target = os.path.join(work_dir, f"input_{n_rows}" + (".xlsx" if fmt == "xlsx" else ""))
+    source = write_input(edw_df, journal_df, target, fmt)
+
+    orchestrator = AgentOrchestrator({
+        **llm_config,
+        "report_dir": os.path.join(work_dir, f"report_{n_rows}"),
+        "metrics_path": "",
+        "cache_path": "",
+    })
+    started = time.perf_counter()
+    excel_file, _ = orchestrator.run_all(source, "")
+    excel_file.close()
+    metrics = orchestrator.metrics.to_dict()
+    return {
+        "rows": n_rows,
+        "format": fmt,
+        "edw_rows": len(edw_df),
+        "journal_rows": len(journal_df),
+        "injected": injected,
+        "total_s": round(time.perf_counter() - started, 3),
+        "statuses": {k: int(v) for k, v in orchestrator.recon_df["Status"].value_counts().items()},
+        "stages": metrics["stages"],
+        "llm": metrics["llm"],
+        "peak_rss_mb": metrics["peak_rss_mb"],
+    }
+
+
+def compare(current, baseline, threshold):
+    """Print per-stage wall-time ratios; return the regressions found."""
+    old = {
+        (result["rows"], stage["stage"]): stage["wall_s"]
+        for result in baseline["results"] for stage in result["stages"]
+    }
+    rows, regressions = [], []
+    for result in current["results"]:
+        for stage in result["stages"]:
+            before = old.get((result["rows"], stage["stage"]))
+            if before is None:
+                continue
+            ratio = stage["wall_s"] / before if before else float("inf")
+            rows.append({"rows": result["rows"], "stage": stage["stage"], "baseline_s": before,
+                         "current_s": stage["wall_s"], "ratio": round(ratio, 2)})
+            # Very short stages are mostly noise
+            if ratio > threshold and stage["wall_s"] >= MIN_COMPARED_SECONDS:
+                regressions.append(rows[-1])
+    if rows:
+        print(pd.DataFrame(rows).to_string(index=False))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the reconciliation pipeline offline.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--format", choices=["xlsx", "csv", "parquet"], help="input format (default: by size)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json", help="where to write the results")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown ratio reported as a regression")
+    parser.add_argument("--latency", type=float, default=0.2, help="mock seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=500, help="mock output throughput")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of mock requests answered 429")
+    parser.add_argument("--server-error-rate", type=float, default=0.0, help="share of mock requests answered 500")
+    parser.add_argument("--config", help="JSON file of agent options to benchmark with")
+    args = parser.parse_args(argv)
+
+    mock = {
+        "latency": args.latency, "jitter": 0.0, "tokens_per_second": args.tokens_per_second,
+        "rate_limit_rate": args.rate_limit_rate, "server_error_rate": args.server_error_rate,
+        "retry_after": 0.1, "seed": args.seed,
+    }
+    url, server = start_in_thread(**mock)
+    llm_config = {
+        "azure_endpoint": url, "api_key": "mock", "api_version": "2024-06-01", "model_name": "mock",
+        "retry_base_delay": 0.1,
+    }
+    if args.config:
+        with open(args.config, encoding="utf-8") as f:
+            llm_config.update(json.load(f))
+
+    results = []
+    try:
+        with tempfile.TemporaryDirectory(prefix="recon_bench_") as work_dir:
+            for n_rows in args.sizes:
+                print(f"Reconciling {n_rows} transactions...", file=sys.stderr)
+                result = run_size(n_rows, llm_config, work_dir, args.format, args.seed)
+                print(f"  {result['total_s']}s, {result['llm']['calls']} mock GPT calls", file=sys.stderr)
+                results.append(result)
+    finally:
+        server.shutdown()
+
+    current = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "mock": mock,
+        "mismatches": DEFAULT_MISMATCHES,
+        "options": {k: v for k, v in llm_config.items() if k not in ("azure_endpoint", "api_key")},
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(current, f, indent=2, default=str)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(current, json.load(f), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} stage(s) slower than {args.threshold}x the baseline.", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,268 @@
+# job_queue.py
+"""Background reconciliation jobs for the Streamlit app.
+
+A :class:`JobQueue` runs reconciliations in a small pool of worker threads, so
+the script run that submits one returns at once and later reruns only poll its
+progress. Finished reports are kept in a :class:`ReportCache` keyed on a hash
+of the uploaded workbook, the SOP and the options that change the result, so
+uploading the same files again returns the earlier report instantly.
+"""
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from agents.orchestrator import AgentOrchestrator
+from utils.pdf_parser import extract_text_from_pdf
+
+DEFAULT_REPORT_CACHE_DIR = os.path.join(".cache", "reports")
+REPORT_NAME = "Final_Reconciliation_Report.xlsx"
+# Credentials and output locations do not change what a run produces
+UNKEYED_OPTIONS = {
+    "api_key", "azure_endpoint", "api_version", "report_dir", "metrics_path", "profile_path",
+    "cache_path", "open_items_path", "report_cache_dir",
+}
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+def job_key(workbook_bytes, sop_bytes, llm_config):
+    """Hash of everything that determines a run's report."""
+    options = {k: v for k, v in llm_config.items() if k not in UNKEYED_OPTIONS}
+    digest = hashlib.sha256()
+    for part in (workbook_bytes, sop_bytes or b"", json.dumps(options, sort_keys=True, default=str).encode("utf-8")):
+        # Length-prefixed, so the parts cannot run into each other
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class ReportCache:
+    """Finished reports on disk, one directory per job key.
+
+    A run writes its report into a :meth:`staging_dir`, which :meth:`put`
+    moves into place, so no copy is left outside the cache. Entries older
+    than ``max_age_seconds`` and the least recently used ones beyond
+    ``max_entries`` are evicted whenever a report is added.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_REPORT_CACHE_DIR, max_entries=50, max_age_seconds=7 * 86400):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key):
+        """Return ``{"report_path", "logs", "metrics"}`` for ``key``, or None."""
+        meta_path = os.path.join(self._entry(key), "result.json")
+        with self._lock:
+            try:
+                with open(meta_path, encoding="utf-8") as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                return None
+            if time.time() - meta["created"] > self.max_age_seconds:
+                shutil.rmtree(self._entry(key), ignore_errors=True)
+                return None
+            # The file's modification time records the last use
+            os.utime(meta_path)
+        return {**meta, "report_path": os.path.join(self._entry(key), REPORT_NAME)}
+
+    def staging_dir(self, key):
+        """A new directory path to write the report for ``key`` into."""
+        return f"{self._entry(key)}.{uuid.uuid4().hex}.tmp"
+
+    def put(self, key, staging, logs, metrics):
+        """Move a finished report's :meth:`staging_dir` into the cache;
+        returns the cached report's path."""
+        entry = self._entry(key)
+        with open(os.path.join(staging, "result.json"), "w", encoding="utf-8") as f:
+            json.dump({"created": time.time(), "logs": logs, "metrics": metrics}, f, default=str)
+        with self._lock:
+            shutil.rmtree(entry, ignore_errors=True)
+            os.replace(staging, entry)
+            self._evict()
+        return os.path.join(entry, REPORT_NAME)
+
+    def _evict(self):
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".tmp"):
+                # Left behind by a run that never finished
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    if now - os.path.getmtime(path) > self.max_age_seconds:
+                        shutil.rmtree(path, ignore_errors=True)
+                except OSError:
+                    pass
+                continue
+            meta_path = os.path.join(self.cache_dir, name, "result.json")
+            try:
+                entries.append((os.path.getmtime(meta_path), name))
+            except OSError:
+                continue
+        entries.sort(reverse=True)
+        for n, (used, name) in enumerate(entries):
+            if n >= self.max_entries or now - used > self.max_age_seconds:
+                shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+
+
+def report_cache_from_config(llm_config):
+    """Build the report cache described by the config, or None when
+    ``report_cache_dir`` is set to an empty value."""
+    cache_dir = llm_config.get("report_cache_dir", DEFAULT_REPORT_CACHE_DIR)
+    if not cache_dir:
+        return None
+    return ReportCache(
+        cache_dir,
+        max_entries=llm_config.get("report_cache_max_entries", 50),
+        max_age_seconds=llm_config.get("report_cache_max_age_days", 7) * 86400,
+    )
+
+
+class Job:
+    """One reconciliation. Written by its worker thread, polled by the app."""
+
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex[:12]
+        self.key = key
+        self.status = QUEUED
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.cached = False
+        self.logs = []
+        self.error = None
+        self.report_path = None
+        self.metrics = None
+        # Latest (agent name, rows so far) reported while GPT responses stream in
+        self.partial = None
+        self._orchestrator = None
+
+    @property
+    def done(self):
+        return self.status in (DONE, FAILED)
+
+    def progress(self):
+        """``(finished, running)``: the stage records completed so far and
+        the names of the stages still running."""
+        metrics = self._orchestrator.metrics if self._orchestrator is not None else None
+        if metrics is None:
+            return [], []
+        return list(metrics.stages), list(metrics.active)
+
+    def metrics_frame(self):
+        return pd.DataFrame(self.metrics) if self.metrics else None
+
+    def open_report(self):
+        """The finished report, opened for reading; the caller closes it."""
+        return open(self.report_path, "rb")
+
+
+class JobQueue:
+    """Runs jobs on ``max_workers`` threads and keeps the last ``max_jobs``
+    of them for polling. An upload identical to one still running joins it
+    instead of starting another run.
+
+    Reports are written into the cache (any ``report_dir`` option is
+    overridden). Without a cache, each job gets a directory in a temporary
+    work directory, removed when the job is no longer kept.
+    """
+
+    def __init__(self, max_workers=2, cache=None, max_jobs=200):
+        self.cache = cache
+        self.max_jobs = max_jobs
+        self._work_dir = tempfile.mkdtemp(prefix="recon_jobs_") if cache is None else None
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix="recon-job")
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._pending = {}
+
+    def submit(self, workbook_bytes, sop_bytes, llm_config):
+        key = job_key(workbook_bytes, sop_bytes, llm_config)
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+            job = Job(key)
+            cached = self.cache.get(key) if self.cache is not None else None
+            if cached is not None:
+                job.report_path = cached["report_path"]
+                job.logs = cached["logs"]
+                job.metrics = cached["metrics"]
+                job.cached = True
+                job.status = DONE
+                job.started = job.finished = job.submitted
+            else:
+                self._pending[key] = job
+                self._pool.submit(self._run, job, workbook_bytes, sop_bytes, llm_config)
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.max_jobs:
+                oldest = next(iter(self._jobs.values()))
+                if not oldest.done:
+                    break
+                self._jobs.popitem(last=False)
+                if self._work_dir is not None:
+                    shutil.rmtree(os.path.join(self._work_dir, oldest.id), ignore_errors=True)
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def _run(self, job, workbook_bytes, sop_bytes, llm_config):
+        job.status = RUNNING
+        job.started = time.time()
+        if self.cache is not None:
+            report_dir = self.cache.staging_dir(job.key)
+        else:
+            report_dir = os.path.join(self._work_dir, job.id)
+        try:
+            sop_text = ""
+            if sop_bytes:
+                # An unreadable SOP only costs the run its context, as it always has
+                try:
+                    sop_text = extract_text_from_pdf(io.BytesIO(sop_bytes))
+                    job.logs.append(
+                        f"[App] SOP loaded ({len(sop_text.split())} words)." if sop_text
+                        else "[App] Could not read SOP. Proceeding without SOP context."
+                    )
+                except Exception as e:
+                    job.logs.append(f"[App] ⚠️ Could not read SOP: {e}. Proceeding without SOP context.")
+
+            job._orchestrator = orchestrator = AgentOrchestrator({**llm_config, "report_dir": report_dir})
+
+            def on_progress(agent_name, partial_df):
+                job.partial = (agent_name, partial_df)
+
+            try:
+                excel_file, _ = orchestrator.run_all(io.BytesIO(workbook_bytes), sop_text, on_progress=on_progress)
+                excel_file.close()
+            finally:
+                job.logs.extend(orchestrator.logs)
+            job.metrics = orchestrator.metrics.to_frame().to_dict("records")
+            job.report_path = orchestrator.report_path
+            if self.cache is not None:
+                job.report_path = self.cache.put(job.key, report_dir, job.logs, job.metrics)
+            job.status = DONE
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            job.status = FAILED
+            shutil.rmtree(report_dir, ignore_errors=True)
+        finally:
+            job.partial = None
+            job.finished = time.time()
+            with self._lock:
+                self._pending.pop(job.key, None)
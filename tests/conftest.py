@@ -0,0 +1,6 @@
+# tests/conftest.py
+import os
+import sys
+
+# The agents import ``utils`` from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,55 @@
+# tests/test_csv_stream.py
+from utils.csv_stream import IncrementalCSVParser
+
+HEADER = ["Ref 1", "Issue", "Suggested Resolution"]
+
+
+def _parse(chunks):
+    parser = IncrementalCSVParser(HEADER)
+    records = []
+    for chunk in chunks:
+        records += parser.feed(chunk)
+    return records + parser.close(), parser
+
+
+def _split(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def test_quoted_commas_and_line_breaks_survive_any_chunking():
+    text = 'Ref 1,Issue,Suggested Resolution\nA1,"date, off","check\nthe ""stmt"" date"\nA2,amount,rebook\n'
+    for size in (1, 3, 7, len(text)):
+        records, parser = _parse(_split(text, size))
+        assert records == [
+            {"Ref 1": "A1", "Issue": "date, off", "Suggested Resolution": 'check\nthe "stmt" date'},
+            {"Ref 1": "A2", "Issue": "amount", "Suggested Resolution": "rebook"},
+        ]
+        assert parser.malformed == []
+
+
+def test_code_fences_are_skipped():
+    records, _ = _parse(_split("```csv\nRef 1,Issue,Suggested Resolution\nA1,x,y\n```", 4))
+    assert records == [{"Ref 1": "A1", "Issue": "x", "Suggested Resolution": "y"}]
+
+
+def test_reordered_header_maps_fields_by_name():
+    records, _ = _parse(_split("Issue,Suggested Resolution,ref 1\nx,y,A1", 5))
+    assert records == [{"Ref 1": "A1", "Issue": "x", "Suggested Resolution": "y"}]
+
+
+def test_malformed_rows_are_kept_aside():
+    records, parser = _parse(_split("Ref 1,Issue,Suggested Resolution\nA1,x\nA2,x,y,z\nA3,x,y", 6))
+    assert [record["Ref 1"] for record in records] == ["A3"]
+    assert parser.malformed == ["A1,x", "A2,x,y,z"]
+
+
+def test_header_repeated_mid_stream_is_skipped():
+    text = "Ref 1,Issue,Suggested Resolution\nA1,x,y\nRef 1,Issue,Suggested Resolution\nA2,x,y\n"
+    records, parser = _parse(_split(text, 4))
+    assert [record["Ref 1"] for record in records] == ["A1", "A2"]
+    assert parser.malformed == []
+
+
+def test_rows_without_a_header_use_the_expected_order():
+    records, _ = _parse(["A1,x,", "y\n"])
+    assert records == [{"Ref 1": "A1", "Issue": "x", "Suggested Resolution": "y"}]
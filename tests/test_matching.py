@@ -0,0 +1,88 @@
+# tests/test_matching.py
+import itertools
+
+import pandas as pd
+
+from utils import matching
+from utils.matching import find_subset, split_match, tolerance_match
+from utils.schema import normalize_source
+
+
+def test_nearest_candidate_within_tolerance_survives_a_crowded_window():
+    # 60 Journal rows three days early are off in amount; the same-day one is not
+    edw = pd.DataFrame({
+        "Account Number": ["ACCOUNT0001"],
+        "Tran Code": "TC100",
+        "Process Date": pd.Timestamp("2024-01-10"),
+        "Amount": [-10.00],
+    })
+    journal = pd.DataFrame({
+        "Account Number": "ACCOUNT0001",
+        "Tran Code": "TC100",
+        "Journal Date": [pd.Timestamp("2024-01-07")] * 60 + [pd.Timestamp("2024-01-10")],
+        "Debit Amount": [99.00] * 60 + [10.01],
+    })
+    matched, edw_left, journal_left = tolerance_match(
+        normalize_source(edw, "EDW"),
+        normalize_source(journal, "Journal"),
+        amount_tolerance=0.05,
+    )
+    assert len(matched) == 2 and edw_left.empty and len(journal_left) == 60
+    assert (matched["Status"] == "PARTIAL").all()
+
+
+def _split_sources(journal_debits, edw_amounts, day="2024-01-10"):
+    edw = pd.DataFrame({
+        "Account Number": "ACCOUNT0001",
+        "Tran Code": "TC100",
+        "Process Date": pd.Timestamp(day),
+        "Amount": edw_amounts,
+    })
+    journal = pd.DataFrame({
+        "Account Number": "ACCOUNT0001",
+        "Tran Code": "TC100",
+        "Journal Date": pd.Timestamp(day),
+        "Debit Amount": journal_debits,
+    })
+    return normalize_source(edw, "EDW"), normalize_source(journal, "Journal")
+
+
+def test_find_subset_finds_an_exact_three_part_split():
+    values = [500, 1200, 300, 700, 50]
+    indices, difference = find_subset(values, 2000, max_size=3)
+    assert difference == 0
+    assert sorted(values[i] for i in indices) == [300, 500, 1200]
+
+
+def test_find_subset_respects_the_group_size_cap():
+    assert find_subset([100] * 5, 500, max_size=4) is None
+    assert find_subset([100] * 5, 500, max_size=5) == ([0, 1, 2, 3, 4], 0)
+
+
+def test_split_match_links_negative_edw_parts_to_a_journal_debit():
+    edw, journal = _split_sources([100.00], [-60.00, -25.00, -15.00, -7.00])
+    matched, edw_left, journal_left = split_match(edw, journal)
+    assert journal_left.empty and list(edw_left["Amount"]) == [-700]
+    assert matched["Ref 1"].nunique() == 1
+    assert (matched["Rule"] == "SPLIT").all() and (matched["Status"] == "MATCHED").all()
+    # Matching is on magnitude; the sign still decides SIDE and stays in Amount
+    edw_rows = matched[matched["Item Type"] == "EDW"]
+    assert (edw_rows["SIDE"] == "CR").all() and (edw_rows["Amount"] < 0).all()
+    assert matched.loc[matched["Item Type"] == "Journal", "SIDE"].tolist() == ["DR"]
+
+
+def test_split_match_groups_over_the_size_cap_stay_unmatched():
+    edw, journal = _split_sources([50.00], [-10.00] * 5)
+    matched, edw_left, journal_left = split_match(edw, journal, max_group_size=4)
+    assert matched.empty and len(edw_left) == 5 and len(journal_left) == 1
+
+
+def test_split_match_keeps_what_it_found_when_the_budget_runs_out(monkeypatch):
+    # Every clock read advances a second: the first Journal row is searched,
+    # the budget is spent before the second
+    clock = itertools.count()
+    monkeypatch.setattr(matching.time, "perf_counter", lambda: next(clock))
+    edw, journal = _split_sources([100.00, 90.00], [-60.00, -40.00, -50.00, -40.00])
+    matched, edw_left, journal_left = split_match(edw, journal, time_budget=1.5)
+    assert matched["Ref 1"].nunique() == 1 and len(matched) == 3
+    assert len(journal_left) == 1 and len(edw_left) == 2
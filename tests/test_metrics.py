@@ -0,0 +1,15 @@
+# tests/test_metrics.py
+from utils.metrics import RunMetrics
+
+
+def test_outer_stage_keeps_its_peak_across_inner_stages():
+    metrics = RunMetrics(trace_memory=True)
+    with metrics.stage("outer"):
+        block = bytearray(20 * 2**20)
+        del block
+        with metrics.stage("inner"):
+            block = bytearray(2**20)
+            del block
+    peaks = {record["stage"]: record["peak_alloc_mb"] for record in metrics.stages}
+    assert peaks["outer"] >= 20
+    assert 1 <= peaks["inner"] < 20
@@ -0,0 +1,59 @@
+# tests/test_open_items.py
+import pandas as pd
+
+from utils.matching import concat_rows, exact_match, unmatched_rows
+from utils.open_items import OpenItemStore
+from utils.schema import normalize_source
+
+
+def _edw(rows):
+    return normalize_source(pd.DataFrame(rows, columns=["Account Number", "Tran Code", "Process Date", "Amount"]), "EDW")
+
+
+def _journal(rows):
+    return normalize_source(
+        pd.DataFrame(rows, columns=["Account Number", "Tran Code", "Journal Date", "Debit Amount"]), "Journal"
+    )
+
+
+def _run(store, edw, journal):
+    frames, stats = store.prepare(edw, journal)
+    matched, edw_left, journal_left = exact_match(frames["EDW"], frames["Journal"])
+    recon = concat_rows(matched, unmatched_rows(edw_left, "EDW"), unmatched_rows(journal_left, "Journal"))
+    return frames, stats, store.update(frames, recon)
+
+
+DAY1_EDW = [["ACCOUNT0001", "TC100", "2024-01-02", -100.00]]
+DAY1_JOURNAL = [["ACCOUNT0002", "TC100", "2024-01-02", 50.00]]
+
+
+def test_unmatched_item_is_carried_forward_to_the_next_run(tmp_path):
+    store = OpenItemStore(str(tmp_path / "open_items.sqlite"))
+    _, _, counts = _run(store, _edw(DAY1_EDW), _journal(DAY1_JOURNAL))
+    assert counts == {"closed": 0, "open": 2}
+
+    # Day two repeats day one and adds a Journal row that does not match
+    journal = _journal(DAY1_JOURNAL + [["ACCOUNT0001", "TC100", "2024-01-03", 70.00]])
+    frames, stats, counts = _run(store, _edw(DAY1_EDW), journal)
+    assert stats["EDW"] == {"new": 0, "skipped": 1, "carried": 1}
+    # ACCOUNT0002 has no new rows, so its open item stays in the store untouched
+    assert stats["Journal"] == {"new": 1, "skipped": 1, "carried": 0}
+    assert len(frames["EDW"]) == 1 and frames["EDW"]["Amount"].tolist() == [-10000]
+    assert counts == {"closed": 0, "open": 2}
+    assert store.stats() == "1 open EDW items, 2 open Journal items"
+
+
+def test_open_item_matched_later_is_retired(tmp_path):
+    store = OpenItemStore(str(tmp_path / "open_items.sqlite"))
+    _run(store, _edw(DAY1_EDW), _journal(DAY1_JOURNAL))
+
+    journal = _journal(DAY1_JOURNAL + [["ACCOUNT0001", "TC100", "2024-01-02", 100.00]])
+    frames, stats, counts = _run(store, _edw(DAY1_EDW), journal)
+    assert stats["EDW"]["carried"] == 1
+    assert counts == {"closed": 2, "open": 0}
+    assert store.stats() == "0 open EDW items, 1 open Journal items"
+
+    # Nothing new and nothing open on the account: the next run has no work
+    frames, stats, _ = _run(store, _edw(DAY1_EDW), journal)
+    assert frames["EDW"].empty and frames["Journal"].empty
+    assert stats["EDW"] == {"new": 0, "skipped": 1, "carried": 0}
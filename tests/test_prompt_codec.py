@@ -0,0 +1,46 @@
+# tests/test_prompt_codec.py
+import pandas as pd
+
+from utils.batching import pair_blocks
+from utils.prompt_codec import PromptCodec
+from utils.schema import normalize_source
+
+
+def _sources():
+    # ACCOUNT0001 appears once in EDW but twice in Journal
+    accounts_edw = ["ACCOUNT0001"] + [f"ACCOUNT{n:04d}" for n in range(2, 8) for _ in range(3)]
+    accounts_journal = ["ACCOUNT0001", "ACCOUNT0001"] + [f"ACCOUNT{n:04d}" for n in range(2, 8) for _ in range(3)]
+    edw = pd.DataFrame({
+        "Account Number": accounts_edw,
+        "Tran Code": "TC100",
+        "Process Date": pd.Timestamp("2024-01-02"),
+        "Amount": [-10.0 - n for n in range(len(accounts_edw))],
+    })
+    journal = pd.DataFrame({
+        "Account Number": accounts_journal,
+        "Tran Code": "TC100",
+        "Journal Date": pd.Timestamp("2024-01-03"),
+        "Debit Amount": [5.0 + n for n in range(len(accounts_journal))],
+    })
+    return normalize_source(edw, "EDW"), normalize_source(journal, "Journal")
+
+
+def test_account_repeated_on_one_side_gets_the_same_code_on_both():
+    edw, journal = _sources()
+    codec = PromptCodec()
+    codec.learn_codes((edw, "EDW"), (journal, "Journal"))
+    edw_compact = codec.compact(edw, "EDW")
+    journal_compact = codec.compact(journal, "Journal")
+    assert edw_compact.at[0, "Account"] == journal_compact.at[0, "Account"] == journal_compact.at[1, "Account"]
+    assert codec.decode_value(edw_compact.at[0, "Account"]) == "ACCOUNT0001"
+
+
+def test_both_sides_of_an_account_land_in_one_block():
+    edw, journal = _sources()
+    codec = PromptCodec()
+    codec.learn_codes((edw, "EDW"), (journal, "Journal"))
+    blocks = pair_blocks(codec.compact(edw, "EDW"), codec.compact(journal, "Journal"), token_budget=30)
+    assert len(blocks) > 1
+    holding = [n for n, (edw_block, journal_block) in enumerate(blocks) if "E0" in set(edw_block["id"])]
+    edw_block, journal_block = blocks[holding[0]]
+    assert {"J0", "J1"} <= set(journal_block["id"])
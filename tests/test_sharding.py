@@ -0,0 +1,55 @@
+# tests/test_sharding.py
+import pandas as pd
+
+from utils.matching import concat_rows, exact_match, number_rows, unmatched_rows
+from utils.schema import normalize_source
+from utils.sharding import merge_shards
+
+
+def _shard(account, amounts, orphan):
+    edw = pd.DataFrame({
+        "Account Number": account,
+        "Tran Code": "TC100",
+        "Process Date": pd.Timestamp("2024-01-02"),
+        "Amount": [-a for a in amounts] + [-orphan],
+        "Transaction Ref": [f"{account}-E{n}" for n in range(len(amounts) + 1)],
+    })
+    journal = pd.DataFrame({
+        "Account Number": account,
+        "Tran Code": "TC100",
+        "Journal Date": pd.Timestamp("2024-01-02"),
+        "Debit Amount": amounts,
+    })
+    matched, edw_left, journal_left = exact_match(normalize_source(edw, "EDW"), normalize_source(journal, "Journal"))
+    recon = number_rows(concat_rows(matched, unmatched_rows(edw_left, "EDW")))
+    # Each shard points one suggestion at a match group and one at a row number
+    orphan_no = int(recon.loc[recon["Status"] == "UNMATCHED", "No"].iloc[0])
+    suggestions = pd.DataFrame({
+        "Ref 1": ["AUTO-000002", f"No {orphan_no}"],
+        "Issue": [f"{account} group", f"{account} orphan"],
+        "Suggested Resolution": ["review", "chase"],
+    })
+    return recon, suggestions
+
+
+def test_merged_shards_get_unique_group_ids_that_keep_their_rows():
+    parts = [_shard("ACCOUNT0001", [10.00, 20.00], 5.00), _shard("ACCOUNT0002", [30.00, 40.00, 50.00], 6.00)]
+    # Both shards numbered their groups from AUTO-000001
+    assert set(parts[0][0]["Ref 1"].dropna()) & set(parts[1][0]["Ref 1"].dropna())
+
+    recon, suggestions = merge_shards(parts)
+    assert recon["No"].tolist() == list(range(1, len(recon) + 1))
+    groups = recon[recon["Ref 1"].astype("string").str.startswith("AUTO-").fillna(False)]
+    assert groups["Ref 1"].nunique() == 5
+    # Every group still holds one EDW and one Journal row of the same account and amount
+    for _, rows in groups.groupby("Ref 1"):
+        assert sorted(rows["Item Type"]) == ["EDW", "Journal"]
+        assert rows["Reconciliation"].nunique() == 1 and rows["Amount"].abs().nunique() == 1
+
+    # Suggestions follow their group and row to the merged IDs and numbers
+    by_issue = dict(zip(suggestions["Issue"], suggestions["Ref 1"]))
+    for account, amount in (("ACCOUNT0001", 2000), ("ACCOUNT0002", 4000)):
+        group = recon.loc[recon["Ref 1"] == by_issue[f"{account} group"]]
+        assert set(group["Reconciliation"]) == {account} and set(group["Amount"].abs()) == {amount}
+        orphan = recon.loc[recon["No"] == int(by_issue[f"{account} orphan"].split()[1])]
+        assert orphan["Status"].tolist() == ["UNMATCHED"] and orphan["Reconciliation"].tolist() == [account]
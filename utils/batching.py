@@ -0,0 +1,112 @@
+# utils/batching.py
+"""Split agent inputs into blocks that can be sent to GPT independently."""
+import pandas as pd
+
+from .schema import find_column
+
+# Rough characters-per-token ratio for CSV text with GPT tokenizers
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    """Estimate the tokens ``text`` costs in a prompt or completion."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def row_tokens(df):
+    """Estimate the prompt tokens each row of ``df`` costs as a CSV line."""
+    if df.empty:
+        return pd.Series(dtype="int64", index=df.index)
+    chars = sum(df[col].astype(str).str.len() for col in df.columns) + len(df.columns)
+    return chars // CHARS_PER_TOKEN + 1
+
+
+def _unit_keys(df, with_entity=True):
+    """Key every row by the smallest independent unit: its account, prefixed by
+    Bus Entity so packing keeps an entity's accounts together."""
+    account_col = find_column(df, "account")
+    entity_col = find_column(df, "bus_entity") if with_entity else None
+    if account_col is None:
+        return pd.Series("", index=df.index)
+    account = df[account_col].astype(str).str.strip()
+    if entity_col is None:
+        return account
+    return df[entity_col].astype(str).str.strip() + "|" + account
+
+
+def _pack(unit_costs, token_budget):
+    """Greedily pack ordered ``(unit, cost)`` pairs into lists of units whose
+    total cost stays under ``token_budget``. A unit larger than the budget gets
+    a block of its own."""
+    blocks, current, used = [], [], 0
+    for unit, cost in unit_costs:
+        if current and used + cost > token_budget:
+            blocks.append(current)
+            current, used = [], 0
+        current.append(unit)
+        used += cost
+    if current:
+        blocks.append(current)
+    return blocks
+
+
+def pair_blocks(edw_df, journal_df, token_budget):
+    """Split EDW and Journal into ``(edw_block, journal_block)`` pairs.
+
+    Matching never crosses accounts, so every account lands whole in one block
+    with both of its sides. Entities without an account column on both sides
+    cannot be split and come back as a single block.
+    """
+    if find_column(edw_df, "account") is None or find_column(journal_df, "account") is None:
+        return [(edw_df, journal_df)]
+
+    edw_units = _unit_keys(edw_df, with_entity=False)
+    journal_units = _unit_keys(journal_df, with_entity=False)
+
+    # Journals rarely carry Bus Entity, so the account is the unit on both
+    # sides and the EDW entity only orders the units for packing.
+    entity_col = find_column(edw_df, "bus_entity")
+    entity_of = (
+        edw_df[entity_col].astype(str).groupby(edw_units).first()
+        if entity_col
+        else pd.Series(dtype=str)
+    )
+    costs = pd.concat([row_tokens(edw_df), row_tokens(journal_df)]).groupby(
+        pd.concat([edw_units, journal_units])
+    ).sum()
+    ordered = sorted(costs.items(), key=lambda item: (entity_of.get(item[0], ""), item[0]))
+    blocks = _pack(ordered, token_budget)
+    return [
+        (edw_df[edw_units.isin(units)], journal_df[journal_units.isin(units)])
+        for units in blocks
+    ]
+
+
+def row_blocks(df, token_budget):
+    """Split rows that are processed independently, keeping accounts together
+    where the budget allows and splitting oversized accounts by row."""
+    if df.empty:
+        return []
+    units = _unit_keys(df)
+    costs = row_tokens(df)
+    ordered = df.assign(_unit=units, _cost=costs).sort_values("_unit", kind="stable")
+
+    blocks, current, used = [], [], 0
+    for unit, group in ordered.groupby("_unit", sort=False):
+        group_cost = group["_cost"].sum()
+        if group_cost > token_budget:
+            for idx, cost in group["_cost"].items():
+                if current and used + cost > token_budget:
+                    blocks.append(current)
+                    current, used = [], 0
+                current.append(idx)
+                used += cost
+            continue
+        if current and used + group_cost > token_budget:
+            blocks.append(current)
+            current, used = [], 0
+        current.extend(group.index)
+        used += group_cost
+    if current:
+        blocks.append(current)
+    return [df.loc[idx] for idx in blocks]
@@ -0,0 +1,160 @@
+# utils/csv_stream.py
+"""Incremental, quote-aware parsing of CSV tables streamed back by GPT."""
+import csv
+import time
+
+from .llm import complete_many
+
+
+class IncrementalCSVParser:
+    """Turn streamed CSV text into records as soon as each row completes.
+
+    A row is complete at the first newline outside double quotes, so quoted
+    fields may hold commas and line breaks. Markdown fences and header rows
+    are skipped, including a header repeated mid-stream; a leading header
+    with the expected columns in another order is honoured. Rows whose field count does not match the header are
+    kept in ``malformed`` (as raw text) instead of being padded or merged.
+    """
+
+    def __init__(self, expected_header):
+        self.expected_header = list(expected_header)
+        self.header = None
+        self.malformed = []
+        self._pending = ""
+        self._scan_from = 0
+        self._quotes = 0
+
+    def reset(self):
+        """Forget everything seen so far, e.g. before a retried call."""
+        self.__init__(self.expected_header)
+
+    def feed(self, text):
+        """Add streamed ``text`` and return the records it completed."""
+        self._pending += text
+        records = []
+        while True:
+            newline = self._pending.find("\n", self._scan_from)
+            if newline == -1:
+                self._quotes += self._pending.count('"', self._scan_from)
+                self._scan_from = len(self._pending)
+                return records
+            self._quotes += self._pending.count('"', self._scan_from, newline)
+            if self._quotes % 2:
+                # Inside a quoted field, keep scanning past this line break
+                self._scan_from = newline + 1
+                continue
+            line = self._pending[:newline]
+            self._pending = self._pending[newline + 1:]
+            self._scan_from = 0
+            self._quotes = 0
+            record = self._parse_line(line)
+            if record is not None:
+                records.append(record)
+
+    def close(self):
+        """Flush the last row once the stream has ended."""
+        line, self._pending = self._pending, ""
+        self._scan_from = 0
+        self._quotes = 0
+        record = self._parse_line(line)
+        return [record] if record is not None else []
+
+    def _parse_line(self, line):
+        stripped = line.strip()
+        if not stripped or stripped.startswith("```"):
+            return None
+        fields = next(csv.reader([stripped]))
+        names = [field.strip().lower() for field in fields]
+        is_header = sorted(names) == sorted(col.lower() for col in self.expected_header)
+        if self.header is None:
+            self.header = self.expected_header
+            if is_header:
+                lookup = {col.lower(): col for col in self.expected_header}
+                self.header = [lookup[name] for name in names]
+        if is_header:
+            return None
+        if len(fields) != len(self.header):
+            self.malformed.append(stripped)
+            return None
+        return {col: field.strip() for col, field in zip(self.header, fields)}
+
+
+def parse_csv(text, expected_header):
+    """Parse a complete CSV response; returns ``(records, malformed_lines)``."""
+    parser = IncrementalCSVParser(expected_header)
+    records = parser.feed(text) + parser.close()
+    return records, parser.malformed
+
+
+def _repair_prompt(header, lines):
+    return f"""
+The following CSV rows are malformed: each must have exactly {len(header)} fields.
+
+**Header:**
+{",".join(header)}
+
+**Malformed rows:**
+{chr(10).join(lines)}
+
+Re-emit ONLY these rows, corrected, with exactly these columns in this order. Wrap any field containing a comma in double quotes. No header, explanations, markdown or code blocks.
+"""
+
+
+def stream_csv_tables(
+    llm_config, prompts, header, cache=None, on_records=None, progress_interval=0.5, stats=None, on_block=None
+):
+    """Run ``prompts`` that each answer with a CSV table of ``header`` columns.
+
+    Responses are streamed (unless ``stream_responses`` is off in the config)
+    and parsed row by row; ``on_records(records)`` is called with every record
+    collected so far when new rows complete, at most every ``progress_interval``
+    seconds. Malformed rows are asked for once more in a follow-up call.
+    ``stats`` is passed on to the GPT gateway. ``on_block(index, records)``
+    is called with the records of each prompt as soon as its response is
+    complete, in completion order.
+
+    Returns ``(records, repaired, dropped)``: the parsed records of all
+    prompts in order, how many malformed rows the follow-up fixed, and the
+    raw lines that stayed malformed.
+    """
+    parsers = [IncrementalCSVParser(header) for _ in prompts]
+    records = [[] for _ in prompts]
+    last_progress = [0.0]
+
+    def on_delta(index, text):
+        if text is None:
+            parsers[index].reset()
+            records[index] = []
+            return
+        completed = parsers[index].feed(text)
+        if completed:
+            records[index].extend(completed)
+            now = time.monotonic()
+            if on_records is not None and now - last_progress[0] >= progress_interval:
+                last_progress[0] = now
+                on_records([r for block in records for r in block])
+
+    streaming = llm_config.get("stream_responses", True)
+
+    def on_done(index, output):
+        if streaming:
+            records[index].extend(parsers[index].close())
+        else:
+            records[index].extend(parsers[index].feed(output) + parsers[index].close())
+        if on_block is not None:
+            on_block(index, records[index])
+
+    max_concurrency = llm_config.get("max_concurrency", 4)
+    complete_many(
+        llm_config, prompts, max_concurrency, cache, on_delta if streaming else None, stats, on_done
+    )
+    flat = [r for block in records for r in block]
+
+    malformed = [line for parser in parsers for line in parser.malformed]
+    if not malformed:
+        return flat, 0, []
+
+    # Ask once more for just the broken rows rather than re-running the block
+    repair = _repair_prompt(header, malformed)
+    fixed, dropped = parse_csv(complete_many(llm_config, [repair], 1, cache, stats=stats)[0], header)
+    return flat + fixed, len(fixed), dropped
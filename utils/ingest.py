@@ -0,0 +1,154 @@
+# utils/ingest.py
+"""Read the EDW and Journal inputs with bounded memory.
+
+Excel workbooks are opened once in openpyxl's read-only mode and both sheets
+are streamed row by row into typed chunks. The same two logical sheets may
+also be supplied as CSV or Parquet files.
+"""
+import os
+
+import pandas as pd
+
+SHEETS = ("EDW", "Journal")
+DEFAULT_CHUNK_ROWS = 50_000
+
+
+def _source_name(source):
+    return str(getattr(source, "name", source) or "")
+
+
+def _suffix(source):
+    return os.path.splitext(_source_name(source))[1].lower()
+
+
+def coerce_dtypes(df):
+    """Turn object columns that hold only numbers or only dates into numeric
+    and datetime64 columns, and date-named text columns into datetime64 when
+    every value parses; everything else is left as read."""
+    for col in df.columns:
+        if df[col].dtype != object:
+            continue
+        kind = pd.api.types.infer_dtype(df[col], skipna=True)
+        if kind in ("integer", "floating", "mixed-integer-float", "decimal"):
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+        elif kind in ("datetime", "datetime64", "date"):
+            df[col] = pd.to_datetime(df[col], errors="coerce")
+        elif kind == "string" and "date" in str(col).lower():
+            # CSV has no date type, so trust the header if every value parses
+            parsed = pd.to_datetime(df[col], errors="coerce")
+            if parsed.notna().sum() == df[col].notna().sum():
+                df[col] = parsed
+    return df
+
+
+def _header(values):
+    return [
+        str(value).strip() if value is not None else f"Unnamed: {i}"
+        for i, value in enumerate(values)
+    ]
+
+
+def _iter_worksheet(worksheet, chunk_rows):
+    rows = worksheet.iter_rows(values_only=True)
+    header = None
+    for values in rows:
+        if any(value is not None for value in values):
+            header = _header(values)
+            break
+    if header is None:
+        return
+
+    width = len(header)
+    chunk, yielded = [], False
+    for values in rows:
+        if not any(value is not None for value in values):
+            continue
+        chunk.append(tuple(values[:width]) + (None,) * (width - len(values)))
+        if len(chunk) >= chunk_rows:
+            yield coerce_dtypes(pd.DataFrame.from_records(chunk, columns=header))
+            chunk, yielded = [], True
+    if chunk or not yielded:
+        yield coerce_dtypes(pd.DataFrame.from_records(chunk, columns=header))
+
+
+def iter_excel_chunks(source, sheets=SHEETS, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Open the workbook once and yield ``(sheet, chunk_df)`` for each sheet in
+    turn. Raises ``ValueError`` if a sheet is missing."""
+    from openpyxl import load_workbook
+
+    if hasattr(source, "seek"):
+        source.seek(0)
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        missing = [sheet for sheet in sheets if sheet not in workbook.sheetnames]
+        if missing:
+            raise ValueError(f"Worksheet(s) {', '.join(missing)} not found")
+        for sheet in sheets:
+            for chunk in _iter_worksheet(workbook[sheet], chunk_rows):
+                yield sheet, chunk
+    finally:
+        workbook.close()
+
+
+def iter_table_chunks(source, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Yield typed chunks of a CSV or Parquet file (path or file-like)."""
+    suffix = _suffix(source)
+    if suffix == ".csv":
+        for chunk in pd.read_csv(source, chunksize=chunk_rows):
+            yield coerce_dtypes(chunk)
+    elif suffix in (".parquet", ".pq"):
+        import pyarrow.parquet as pq
+
+        parquet = pq.ParquetFile(source)
+        empty = True
+        for batch in parquet.iter_batches(batch_size=chunk_rows):
+            empty = False
+            yield batch.to_pandas()
+        if empty:
+            yield parquet.schema_arrow.empty_table().to_pandas()
+    else:
+        raise ValueError(f"Unsupported input format: {_source_name(source) or suffix}")
+
+
+def _table_sources(source):
+    """Map a ``{"EDW": ..., "Journal": ...}`` dict or a directory holding
+    ``EDW.csv`` / ``Journal.parquet`` style files to one source per sheet."""
+    if isinstance(source, dict):
+        return {sheet: source[sheet] for sheet in SHEETS}
+    found = {}
+    for name in sorted(os.listdir(source)):
+        stem, suffix = os.path.splitext(name)
+        if stem in SHEETS and suffix.lower() in (".csv", ".parquet", ".pq"):
+            found.setdefault(stem, os.path.join(source, name))
+    missing = [sheet for sheet in SHEETS if sheet not in found]
+    if missing:
+        raise ValueError(f"No CSV/Parquet file for {', '.join(missing)} in {source}")
+    return found
+
+
+def iter_chunks(source, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Yield ``(sheet, chunk_df)`` for the EDW and Journal data in ``source``:
+    an xlsx path or upload, a ``{"EDW": ..., "Journal": ...}`` dict of CSV or
+    Parquet files, or a directory holding them."""
+    if isinstance(source, dict) or (isinstance(source, str) and os.path.isdir(source)):
+        for sheet, table in _table_sources(source).items():
+            for chunk in iter_table_chunks(table, chunk_rows):
+                yield sheet, chunk
+    else:
+        yield from iter_excel_chunks(source, SHEETS, chunk_rows)
+
+
+def load_sheets(source, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Read ``source`` fully and return ``{"EDW": df, "Journal": df}``."""
+    chunks = {sheet: [] for sheet in SHEETS}
+    for sheet, chunk in iter_chunks(source, chunk_rows):
+        chunks[sheet].append(chunk)
+    frames = {}
+    for sheet, parts in chunks.items():
+        if not parts:
+            frames[sheet] = pd.DataFrame()
+            continue
+        frame = parts[0] if len(parts) == 1 else pd.concat(parts, ignore_index=True)
+        # Chunks can disagree on inferred dtypes, so settle them once more
+        frames[sheet] = coerce_dtypes(frame)
+    return frames
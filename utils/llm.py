@@ -0,0 +1,310 @@
+# utils/llm.py
+"""Gateway that every GPT call goes through.
+
+Clients are created once per endpoint and reuse a pooled HTTP connection.
+Calls are capped at ``max_concurrency`` in flight per endpoint, paced by a
+shared requests/tokens-per-minute budget and retried with exponential backoff
+and jitter on rate limits, timeouts and server errors.
+Responses can be streamed fragment by fragment to the caller.
+"""
+import asyncio
+import random
+import threading
+import time
+
+import httpx
+import openai
+from openai import AzureOpenAI
+
+from .batching import estimate_tokens
+from .llm_cache import cache_key
+
+_registry_lock = threading.Lock()
+_clients = {}
+_limiters = {}
+_in_flight = {}
+# Optional cap on calls in flight shared by several processes
+_shared_slots = None
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+class RateLimiter:
+    """Token bucket pacing requests and tokens per minute across threads.
+
+    ``acquire`` blocks until both buckets can cover the call. Either limit may
+    be None to leave that dimension unlimited.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute or 0)
+        self._tokens = float(tokens_per_minute or 0)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._requests = min(
+                self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60
+            )
+        if self.tokens_per_minute:
+            self._tokens = min(
+                self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60
+            )
+
+    def acquire(self, tokens):
+        # A call larger than the whole minute budget waits for a full bucket
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                wait = 0.0
+                if self.requests_per_minute and self._requests < 1:
+                    wait = max(wait, (1 - self._requests) * 60 / self.requests_per_minute)
+                if self.tokens_per_minute and self._tokens < tokens:
+                    wait = max(wait, (tokens - self._tokens) * 60 / self.tokens_per_minute)
+                if wait == 0:
+                    if self.requests_per_minute:
+                        self._requests -= 1
+                    if self.tokens_per_minute:
+                        self._tokens -= tokens
+                    return
+            time.sleep(wait)
+
+    def adjust(self, tokens):
+        """Charge (or refund, if negative) the difference between the estimated
+        and the reported token usage of a finished call."""
+        if not self.tokens_per_minute:
+            return
+        with self._lock:
+            self._tokens = min(self.tokens_per_minute, self._tokens - tokens)
+
+
+def _client(llm_config):
+    key = (
+        llm_config.get("azure_endpoint"),
+        llm_config.get("api_key"),
+        llm_config.get("api_version"),
+    )
+    with _registry_lock:
+        if key not in _clients:
+            max_connections = llm_config.get("max_connections", 20)
+            _clients[key] = AzureOpenAI(
+                api_key=llm_config.get("api_key"),
+                api_version=llm_config.get("api_version"),
+                azure_endpoint=llm_config.get("azure_endpoint"),
+                # Retries are handled here so they share the rate budget
+                max_retries=0,
+                http_client=httpx.Client(
+                    limits=httpx.Limits(
+                        max_connections=max_connections,
+                        max_keepalive_connections=max_connections,
+                    ),
+                    timeout=llm_config.get("request_timeout", 120),
+                ),
+            )
+        return _clients[key]
+
+
+def _limiter(llm_config):
+    key = (llm_config.get("azure_endpoint"), llm_config.get("model_name"))
+    with _registry_lock:
+        if key not in _limiters:
+            _limiters[key] = RateLimiter(
+                llm_config.get("requests_per_minute"),
+                llm_config.get("tokens_per_minute"),
+            )
+        return _limiters[key]
+
+
+def _slots(llm_config):
+    # Every call to an endpoint in this process, whichever agent makes it,
+    # shares one cap of max_concurrency calls in flight
+    key = (llm_config.get("azure_endpoint"), llm_config.get("model_name"))
+    with _registry_lock:
+        if key not in _in_flight:
+            _in_flight[key] = threading.BoundedSemaphore(max(1, llm_config.get("max_concurrency", 4)))
+        return _in_flight[key]
+
+
+def set_shared_slots(slots):
+    """Make every call in this process hold one of ``slots`` while it is in
+    flight, e.g. a ``multiprocessing.Manager().BoundedSemaphore`` handed to
+    all workers of a process pool. ``None`` removes the cap."""
+    global _shared_slots
+    _shared_slots = slots
+
+
+def get_shared_slots():
+    """The slots set by :func:`set_shared_slots`, or None."""
+    return _shared_slots
+
+
+def share_quota(llm_config, workers):
+    """Copy of ``llm_config`` for one of ``workers`` processes calling GPT at
+    once: each paces itself against its share of the per-minute quotas."""
+    config = dict(llm_config)
+    for key in ("requests_per_minute", "tokens_per_minute"):
+        if config.get(key):
+            config[key] = config[key] / workers
+    return config
+
+
+def _retry_delay(error, attempt, base_delay, max_delay=60.0):
+    """Honour the server's Retry-After header, else back off exponentially
+    with full jitter."""
+    response = getattr(error, "response", None)
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        try:
+            return min(float(retry_after), max_delay)
+        except (TypeError, ValueError):
+            pass
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+def _create(client, llm_config, prompt, on_delta):
+    """Make one call; with ``on_delta`` the completion is streamed and each
+    text fragment is passed on as it arrives. Returns ``(content, usage)``."""
+    request = dict(
+        model=llm_config.get("model_name"),
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0
+    )
+    if on_delta is None:
+        response = client.chat.completions.create(**request)
+        return response.choices[0].message.content, getattr(response, "usage", None)
+
+    parts = []
+    for chunk in client.chat.completions.create(stream=True, **request):
+        # Azure sends a first chunk with content filter results and no choices
+        if not chunk.choices:
+            continue
+        text = chunk.choices[0].delta.content
+        if text:
+            parts.append(text)
+            on_delta(text)
+    return "".join(parts), None
+
+
+def complete(llm_config, prompt, cache=None, on_delta=None, stats=None):
+    """Send one prompt and return the stripped completion text.
+
+    With a ``cache``, an identical earlier prompt is answered from disk. With
+    ``on_delta``, the completion is streamed and ``on_delta(text)`` receives
+    each fragment; ``on_delta(None)`` means a retry is starting and anything
+    received so far should be discarded. ``stats`` (a
+    ``utils.metrics.LLMStats``) counts the call, its tokens, retries and
+    latency.
+    """
+    key = None
+    if cache is not None:
+        key = cache_key(llm_config.get("model_name"), prompt, 0)
+        cached = cache.get(key)
+        if cached is not None:
+            if stats is not None:
+                stats.record_cache_hit()
+            if on_delta is not None:
+                on_delta(cached)
+            return cached
+
+    client = _client(llm_config)
+    limiter = _limiter(llm_config)
+    slots = _slots(llm_config)
+    max_retries = llm_config.get("max_retries", 5)
+    # Completions here are CSV tables roughly the size of the data sent
+    estimated = estimate_tokens(prompt) * 2
+
+    for attempt in range(max_retries + 1):
+        limiter.acquire(estimated)
+        started = time.perf_counter()
+        try:
+            with slots:
+                if _shared_slots is None:
+                    content, usage = _create(client, llm_config, prompt, on_delta)
+                else:
+                    with _shared_slots:
+                        content, usage = _create(client, llm_config, prompt, on_delta)
+            break
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            if on_delta is not None:
+                on_delta(None)
+            time.sleep(_retry_delay(e, attempt, llm_config.get("retry_base_delay", 1.0)))
+
+    latency = time.perf_counter() - started
+    if usage is not None and getattr(usage, "total_tokens", None):
+        limiter.adjust(usage.total_tokens - estimated)
+
+    content = content.strip() if content else ""
+    if stats is not None:
+        # Streamed responses report no usage, so fall back to estimates
+        if usage is not None and getattr(usage, "total_tokens", None):
+            prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+        else:
+            prompt_tokens, completion_tokens = estimate_tokens(prompt), estimate_tokens(content)
+        stats.record_call(latency, prompt_tokens, completion_tokens, attempt)
+    if cache is not None and content:
+        cache.put(key, content)
+    return content
+
+
+async def _complete_all(llm_config, prompts, max_concurrency, cache, on_delta, stats, on_done):
+    semaphore = asyncio.Semaphore(max_concurrency)
+    loop = asyncio.get_running_loop()
+
+    async def one(index, prompt):
+        relay = None
+        if on_delta is not None:
+            # Calls run in worker threads; hand fragments back to this thread
+            def relay(text):
+                loop.call_soon_threadsafe(on_delta, index, text)
+        async with semaphore:
+            result = await asyncio.to_thread(complete, llm_config, prompt, cache, relay, stats)
+        if on_done is not None:
+            # Fragments of this call are queued ahead of it, let them through first
+            await asyncio.sleep(0)
+            on_done(index, result)
+        return result
+
+    results = await asyncio.gather(*(one(i, p) for i, p in enumerate(prompts)))
+    # Let fragments queued by the last calls reach on_delta before returning
+    await asyncio.sleep(0)
+    return results
+
+
+def complete_many(llm_config, prompts, max_concurrency=4, cache=None, on_delta=None, stats=None, on_done=None):
+    """Send independent prompts concurrently and return completions in order.
+
+    At most ``max_concurrency`` of these calls are in flight at once, and
+    never more than the endpoint's ``max_concurrency`` together with calls
+    made elsewhere in the process. The first failing
+    call propagates its exception, like a single ``complete`` call would.
+    With ``on_delta``, responses are streamed and ``on_delta(index, text)`` is
+    called on the calling thread for each fragment of prompt ``index``.
+    ``on_done(index, text)`` is called on the calling thread as each prompt
+    finishes, in completion order.
+    """
+    if len(prompts) == 1:
+        relay = None
+        if on_delta is not None:
+            def relay(text):
+                on_delta(0, text)
+        result = complete(llm_config, prompts[0], cache, relay, stats)
+        if on_done is not None:
+            on_done(0, result)
+        return [result]
+    return asyncio.run(
+        _complete_all(llm_config, prompts, max(1, max_concurrency), cache, on_delta, stats, on_done)
+    )
@@ -0,0 +1,102 @@
+# utils/llm_cache.py
+"""On-disk cache of GPT responses shared by the GPT agents.
+
+Entries are keyed on a hash of model, temperature and prompt, so re-running an
+unchanged block returns instantly. Old and least-recently-used entries are
+evicted to keep the file within its age and size limits.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = os.path.join(".cache", "llm_responses.sqlite")
+
+
+def cache_key(model, prompt, temperature):
+    payload = json.dumps([model, temperature, prompt], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=256 * 1024 * 1024, max_age_seconds=30 * 86400):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, key):
+        """Return the cached response for ``key`` or None, counting hits and misses."""
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[1] > self.max_age_seconds:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response):
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now),
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM responses WHERE created < ?", (now - self.max_age_seconds,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop least recently used entries until the cache fits again
+        excess = total - self.max_bytes
+        stale = []
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            stale.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+
+    def stats(self):
+        return f"{self.hits} hits, {self.misses} misses"
+
+
+def cache_from_config(llm_config):
+    """Build the response cache described by the agent config, or None when
+    ``cache_path`` is set to an empty value."""
+    path = llm_config.get("cache_path", DEFAULT_CACHE_PATH)
+    if not path:
+        return None
+    return ResponseCache(
+        path,
+        max_bytes=int(llm_config.get("cache_max_mb", 256) * 1024 * 1024),
+        max_age_seconds=llm_config.get("cache_max_age_days", 30) * 86400,
+    )
@@ -0,0 +1,496 @@
+# utils/matching.py
+"""Deterministic matching passes that run before the GPT agents.
+
+Rows that can be paired by plain rules never need to reach the model, so the
+analyzer only sends the leftovers to GPT.
+"""
+import math
+import time
+from functools import lru_cache
+from itertools import chain, combinations
+
+import numpy as np
+import pandas as pd
+
+from .schema import (
+    FINGERPRINT_COLUMN, MINOR_UNITS, RECON_COLUMNS, empty_recon, find_column, normalize_recon, row_label,
+    to_minor_units,
+)
+
+def _keyed_frame(df, side, dropna=True):
+    """Pull the matching keys out of an EDW or Journal frame.
+
+    Returns None when the frame lacks the account, date or amount columns the
+    deterministic passes need; callers then leave the whole frame to GPT.
+    """
+    account_col = find_column(df, "account")
+    date_col = find_column(df, "edw_date" if side == "EDW" else "journal_date")
+    amount_col = find_column(df, "amount")
+    debit_col = find_column(df, "debit")
+    credit_col = find_column(df, "credit")
+    if account_col is None or date_col is None:
+        return None
+
+    if side == "Journal" and (debit_col or credit_col):
+        debit = to_minor_units(df[debit_col]).astype("float64").fillna(0) if debit_col else 0
+        credit = to_minor_units(df[credit_col]).astype("float64").fillna(0) if credit_col else 0
+        signed = debit - credit
+    elif amount_col is not None:
+        signed = to_minor_units(df[amount_col]).astype("float64")
+    else:
+        return None
+
+    tran_code_col = find_column(df, "tran_code")
+    keyed = pd.DataFrame(index=df.index)
+    keyed["account"] = df[account_col].astype(str).str.strip()
+    keyed["tran_code"] = (
+        df[tran_code_col].astype(str).str.strip() if tran_code_col else ""
+    )
+    keyed["date"] = pd.to_datetime(df[date_col], errors="coerce").dt.normalize()
+    keyed["signed_minor"] = signed
+    # The default rule compares Journal Debit to the sum of absolute EDW amounts,
+    # so matching keys on magnitude and the sign only drives the SIDE column.
+    keyed["minor"] = signed.abs()
+    return keyed.dropna(subset=["date", "minor"]) if dropna else keyed
+
+
+def _recon_rows(df, keyed, side, status, rule, group_ids, scores=None):
+    """Render source rows in the 17-column reconciliation schema."""
+    currency_col = find_column(df, "currency")
+    entity_col = find_column(df, "bus_entity")
+    stmt_col = find_column(df, "stmt_date")
+    ref_col = find_column(df, "reference")
+    source = df.loc[keyed.index]
+
+    rows = pd.DataFrame(index=keyed.index, columns=RECON_COLUMNS)
+    rows["Item Type"] = side
+    rows["Reconciliation"] = keyed["account"]
+    rows["SIDE"] = np.where(keyed["signed_minor"] < 0, "CR", "DR")
+    rows["Value Date"] = keyed["date"]
+    rows["Ref 1"] = list(group_ids)
+    rows["Amount"] = keyed["signed_minor"].astype("Int64")
+    rows["Amt CCY"] = source[currency_col] if currency_col else ""
+    rows["Bus Entity"] = source[entity_col] if entity_col else ""
+    rows["Stmt Date"] = source[stmt_col] if stmt_col else ""
+    rows["Rule"] = rule
+    rows["ENTRY DATE"] = rows["Value Date"]
+    # Ref 2 carries the source reference, or the sheet row when there is none.
+    rows["Ref 2"] = (
+        source[ref_col].astype(str)
+        if ref_col
+        else [row_label(side, i) for i in keyed.index]
+    )
+    rows["Ref 3"] = source[FINGERPRINT_COLUMN] if FINGERPRINT_COLUMN in source.columns else ""
+    rows["Ref 4"] = "" if scores is None else [f"score={s:.2f}" for s in scores]
+    rows["Tran Code"] = keyed["tran_code"]
+    rows["Status"] = status
+    return normalize_recon(rows)
+
+
+def exact_match(edw_df, journal_df, start_group=1):
+    """Pair EDW and Journal rows on account, Tran Code, date and amount.
+
+    Duplicate keys are paired in order of appearance, so three identical EDW
+    rows against two identical Journal rows yield two matches and one leftover.
+
+    Returns ``(recon_rows, edw_left, journal_left)`` where ``recon_rows`` is in
+    the reconciliation schema with ``Status`` MATCHED and the leftovers are the
+    untouched source rows that still need matching.
+    """
+    edw_keys = _keyed_frame(edw_df, "EDW")
+    journal_keys = _keyed_frame(journal_df, "Journal")
+    if edw_keys is None or journal_keys is None:
+        return empty_recon(), edw_df, journal_df
+
+    key_cols = ["account", "tran_code", "date", "minor"]
+    edw_keys["occurrence"] = edw_keys.groupby(key_cols).cumcount()
+    journal_keys["occurrence"] = journal_keys.groupby(key_cols).cumcount()
+
+    pairs = edw_keys.reset_index(names="edw_idx").merge(
+        journal_keys.reset_index(names="journal_idx"),
+        on=key_cols + ["occurrence"],
+        how="inner",
+        suffixes=("_edw", "_journal"),
+    )
+    if pairs.empty:
+        return empty_recon(), edw_df, journal_df
+
+    group_ids = [f"AUTO-{n:06d}" for n in range(start_group, start_group + len(pairs))]
+    matched = interleave(
+        _recon_rows(edw_df, edw_keys.loc[pairs["edw_idx"]], "EDW", "MATCHED", "EXACT", group_ids),
+        _recon_rows(journal_df, journal_keys.loc[pairs["journal_idx"]], "Journal", "MATCHED", "EXACT", group_ids),
+    )
+    return (
+        matched,
+        edw_df.drop(index=pairs["edw_idx"]),
+        journal_df.drop(index=pairs["journal_idx"]),
+    )
+
+
+def tolerance_match(
+    edw_df,
+    journal_df,
+    date_window_days=3,
+    amount_tolerance=0.0,
+    relative_tolerance=0.0,
+    max_candidates=50,
+    start_group=1,
+):
+    """Pair rows whose dates drift by up to ``date_window_days`` and whose amounts
+    differ by at most the absolute or relative tolerance, whichever is larger.
+
+    Journal rows are sorted once on (account, Tran Code, date) and each EDW row
+    finds its candidate window with two ``searchsorted`` calls, so the pass is
+    O(n log n) plus the number of in-window candidates. Of the candidates
+    within the amount tolerance, each EDW row keeps its ``max_candidates``
+    nearest-dated ones (all of them when it is 0 or None). They are scored on
+    date and amount distance and assigned greedily one-to-one, best first.
+
+    Pairs with equal amounts are MATCHED, pairs only within the amount
+    tolerance are PARTIAL. The score is written to ``Ref 4``.
+
+    Returns ``(recon_rows, edw_left, journal_left)`` like :func:`exact_match`.
+    """
+    empty = empty_recon(), edw_df, journal_df
+    edw_keys = _keyed_frame(edw_df, "EDW")
+    journal_keys = _keyed_frame(journal_df, "Journal")
+    if edw_keys is None or journal_keys is None or edw_keys.empty or journal_keys.empty:
+        return empty
+
+    # One integer per row encodes (account, Tran Code) group and day number, so
+    # the window lookup for every group is a single sorted-array search.
+    groups = pd.concat([edw_keys, journal_keys])[["account", "tran_code"]]
+    group_codes = groups.groupby(["account", "tran_code"], sort=False).ngroup().to_numpy()
+    edw_group, journal_group = group_codes[: len(edw_keys)], group_codes[len(edw_keys):]
+
+    day_offset, group_stride = 1 << 20, 1 << 22
+    edw_days = edw_keys["date"].to_numpy().astype("datetime64[D]").astype(np.int64)
+    journal_days = journal_keys["date"].to_numpy().astype("datetime64[D]").astype(np.int64)
+    journal_code = journal_group * group_stride + journal_days + day_offset
+    order = np.argsort(journal_code, kind="stable")
+    journal_sorted = journal_code[order]
+
+    edw_code = edw_group * group_stride + edw_days + day_offset
+    lo = np.searchsorted(journal_sorted, edw_code - date_window_days, side="left")
+    hi = np.searchsorted(journal_sorted, edw_code + date_window_days, side="right")
+    counts = hi - lo
+    if counts.sum() == 0:
+        return empty
+
+    # Expand every EDW row into its candidate Journal positions
+    edw_pos = np.repeat(np.arange(len(edw_keys)), counts)
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    journal_pos = order[lo[edw_pos] + within]
+
+    edw_minor = edw_keys["minor"].to_numpy()[edw_pos]
+    journal_minor = journal_keys["minor"].to_numpy()[journal_pos]
+    amount_diff = np.abs(edw_minor - journal_minor)
+    tolerance = np.maximum(
+        round(amount_tolerance * MINOR_UNITS), relative_tolerance * np.maximum(edw_minor, journal_minor)
+    )
+    keep = amount_diff <= tolerance
+    edw_pos, journal_pos = edw_pos[keep], journal_pos[keep]
+    amount_diff, tolerance = amount_diff[keep], tolerance[keep]
+    if len(edw_pos) == 0:
+        return empty
+
+    date_diff = np.abs(edw_days[edw_pos] - journal_days[journal_pos])
+    if max_candidates:
+        # Only the nearest-dated candidates within the amount tolerance compete
+        nearest = np.lexsort((date_diff, edw_pos))
+        starts = np.searchsorted(edw_pos[nearest], edw_pos[nearest], side="left")
+        nearest = np.sort(nearest[np.arange(len(nearest)) - starts < max_candidates])
+        edw_pos, journal_pos, date_diff = edw_pos[nearest], journal_pos[nearest], date_diff[nearest]
+        amount_diff, tolerance = amount_diff[nearest], tolerance[nearest]
+    amount_term = np.divide(amount_diff, tolerance, out=np.zeros(len(amount_diff)), where=tolerance > 0)
+    score = 1 - 0.5 * date_diff / (date_window_days + 1) - 0.5 * amount_term
+
+    # Greedy one-to-one assignment, best score first, ties broken by position
+    ranked = np.lexsort((journal_pos, edw_pos, -score))
+    used_edw, used_journal, chosen = set(), set(), []
+    for i in ranked:
+        e, j = edw_pos[i], journal_pos[i]
+        if e in used_edw or j in used_journal:
+            continue
+        used_edw.add(e)
+        used_journal.add(j)
+        chosen.append(i)
+    chosen = np.array(sorted(chosen, key=lambda i: edw_pos[i]))
+
+    exact_amount = amount_diff[chosen] == 0
+    status = np.where(exact_amount, "MATCHED", "PARTIAL")
+    rule = np.where(exact_amount, "DATE WINDOW", "AMOUNT TOLERANCE")
+    group_ids = [f"AUTO-{n:06d}" for n in range(start_group, start_group + len(chosen))]
+    edw_idx = edw_keys.index[edw_pos[chosen]]
+    journal_idx = journal_keys.index[journal_pos[chosen]]
+    matched = interleave(
+        _recon_rows(edw_df, edw_keys.loc[edw_idx], "EDW", status, rule, group_ids, score[chosen]),
+        _recon_rows(journal_df, journal_keys.loc[journal_idx], "Journal", status, rule, group_ids, score[chosen]),
+    )
+    return matched, edw_df.drop(index=edw_idx), journal_df.drop(index=journal_idx)
+
+
+@lru_cache(maxsize=None)
+def _combinations(n, size):
+    """Every ``size``-subset of ``range(n)`` as rows of an index array."""
+    flat = np.fromiter(chain.from_iterable(combinations(range(n), size)), dtype=np.intp)
+    members = flat.reshape(-1, size)
+    members.flags.writeable = False
+    return members
+
+
+def _subsets_by_size(values, max_size):
+    """Enumerate subsets of ``values`` up to ``max_size`` items.
+
+    Returns ``{size: (sorted sums, member index rows in the same order)}``;
+    the empty subset is included as size 0 so either half may contribute
+    nothing.
+    """
+    by_size = {0: (np.zeros(1, dtype=np.int64), np.zeros((1, 0), dtype=np.intp))}
+    for size in range(1, min(max_size, len(values)) + 1):
+        members = _combinations(len(values), size)
+        sums = values[members].sum(axis=1)
+        order = np.argsort(sums, kind="stable")
+        by_size[size] = (sums[order], members[order])
+    return by_size
+
+
+# Up to this many candidate groups, summing them all beats meeting in the middle
+EXHAUSTIVE_SUBSETS = 20_000
+
+
+def _closest_subset(values, target, max_size, tolerance):
+    best = None
+    for size in range(2, min(max_size, len(values)) + 1):
+        members = _combinations(len(values), size)
+        diff = np.abs(values[members].sum(axis=1) - target)
+        i = int(np.argmin(diff))
+        if diff[i] <= tolerance and (best is None or int(diff[i]) < best[0][0]):
+            best = ((int(diff[i]), size), members[i])
+    return best
+
+
+def find_subset(values, target, max_size, tolerance=0):
+    """Search for 2..``max_size`` items of ``values`` summing to ``target``
+    within ``tolerance``, all in integer minor units. Small inputs are summed
+    exhaustively, larger ones meet in the middle.
+
+    Returns ``(indices, difference)`` for the closest group, preferring exact
+    sums and then fewer items, or ``None`` if nothing is within tolerance.
+    """
+    values = np.asarray(values, dtype=np.int64)
+    if sum(math.comb(len(values), size) for size in range(2, max_size + 1)) <= EXHAUSTIVE_SUBSETS:
+        best = _closest_subset(values, target, max_size, tolerance)
+        return None if best is None else (best[1].tolist(), best[0][0])
+
+    half = len(values) // 2
+    left_sets = _subsets_by_size(values[:half], max_size)
+    right_sets = _subsets_by_size(values[half:], max_size)
+
+    best = None
+    for left_size, (left_sums, left_members) in left_sets.items():
+        for right_size, (right_sums, right_members) in right_sets.items():
+            size = left_size + right_size
+            if size < 2 or size > max_size:
+                continue
+            # For every left sum, the closest right sum to the remainder
+            wanted = target - left_sums
+            pos = np.clip(np.searchsorted(right_sums, wanted), 1, len(right_sums)) - 1
+            for candidate in (pos, np.minimum(pos + 1, len(right_sums) - 1)):
+                diff = np.abs(wanted - right_sums[candidate])
+                i = int(np.argmin(diff))
+                if diff[i] > tolerance:
+                    continue
+                key = (int(diff[i]), size)
+                if best is None or key < best[0]:
+                    members = np.concatenate([left_members[i], half + right_members[candidate[i]]])
+                    best = (key, members)
+    if best is None:
+        return None
+    return best[1].tolist(), best[0][0]
+
+
+def _date_buckets(groups, days):
+    """Row positions per (account, Tran Code) group code, each bucket sorted
+    by day number, with the day numbers in the same order."""
+    order = np.lexsort((days, groups))
+    starts = np.flatnonzero(np.r_[True, groups[order][1:] != groups[order][:-1]])
+    ends = np.r_[starts[1:], len(order)]
+    return {
+        int(groups[order[a]]): (order[a:b], days[order[a:b]])
+        for a, b in zip(starts, ends)
+    }
+
+
+def split_match(
+    edw_df,
+    journal_df,
+    date_window_days=3,
+    amount_tolerance=0.0,
+    max_group_size=4,
+    max_candidates=20,
+    time_budget=5.0,
+    start_group=1,
+):
+    """Link one row on one side to several rows on the other side of the same
+    account and Tran Code within the date window whose amounts add up to it.
+
+    Journal rows are tried against EDW splits first (one-to-many), then EDW
+    rows against combined Journal entries (many-to-one). Each search looks at
+    the ``max_candidates`` nearest-dated rows; each of the two passes stops
+    once it has spent ``time_budget`` seconds and keeps what it found. Exact
+    sums are MATCHED, sums within ``amount_tolerance`` PARTIAL; every group
+    shares one ``Ref 1``. Amounts are compared by magnitude, like the other
+    passes.
+
+    Returns ``(recon_rows, edw_left, journal_left)`` like :func:`exact_match`.
+    """
+    empty = empty_recon(), edw_df, journal_df
+    edw_keys = _keyed_frame(edw_df, "EDW")
+    journal_keys = _keyed_frame(journal_df, "Journal")
+    if edw_keys is None or journal_keys is None or edw_keys.empty or journal_keys.empty:
+        return empty
+
+    tolerance = round(amount_tolerance * MINOR_UNITS)
+    groups = pd.concat([edw_keys, journal_keys])[["account", "tran_code"]]
+    group_codes = groups.groupby(["account", "tran_code"], sort=False).ngroup().to_numpy()
+    sides = {
+        "EDW": (edw_keys, group_codes[: len(edw_keys)]),
+        "Journal": (journal_keys, group_codes[len(edw_keys):]),
+    }
+    minor = {side: keys["minor"].to_numpy().astype(np.int64) for side, (keys, _) in sides.items()}
+    days = {
+        side: keys["date"].to_numpy().astype("datetime64[D]").astype(np.int64) for side, (keys, _) in sides.items()
+    }
+    used = {side: np.zeros(len(keys), dtype=bool) for side, (keys, _) in sides.items()}
+    placed = []  # (side, position, group id, status, rule, score) in report order
+    next_group = start_group
+
+    for single_side, many_side, rule in (("Journal", "EDW", "SPLIT"), ("EDW", "Journal", "COMBINED")):
+        deadline = time.perf_counter() + time_budget
+        buckets = _date_buckets(sides[many_side][1], days[many_side])
+        many_minor, many_used = minor[many_side], used[many_side]
+        single_groups = sides[single_side][1]
+        for i in range(len(single_groups)):
+            if time.perf_counter() > deadline:
+                break
+            bucket = buckets.get(int(single_groups[i]))
+            if bucket is None or used[single_side][i]:
+                continue
+            positions, bucket_days = bucket
+            day, target = days[single_side][i], minor[single_side][i]
+            lo = np.searchsorted(bucket_days, day - date_window_days, side="left")
+            hi = np.searchsorted(bucket_days, day + date_window_days, side="right")
+            if hi - lo < 2:
+                continue
+            pool = positions[lo:hi]
+            keep = ~many_used[pool] & (many_minor[pool] <= target + tolerance)
+            pool = pool[keep]
+            # Too few candidates, or too little in them to reach the target
+            if len(pool) < 2 or many_minor[pool].sum() < target - tolerance:
+                continue
+            if len(pool) > max_candidates:
+                distance = np.abs(bucket_days[lo:hi][keep] - day)
+                pool = pool[np.argsort(distance, kind="stable")[:max_candidates]]
+
+            found = find_subset(many_minor[pool], int(target), max_group_size, tolerance)
+            if found is None:
+                continue
+            members, diff = found
+            status = "MATCHED" if diff == 0 else "PARTIAL"
+            score = 1.0 if diff == 0 else 1 - 0.5 * diff / tolerance
+            group_id = f"AUTO-{next_group:06d}"
+            next_group += 1
+            used[single_side][i] = True
+            placed.append((single_side, i, group_id, status, rule, score))
+            for member in pool[members]:
+                many_used[member] = True
+                placed.append((many_side, member, group_id, status, rule, score))
+
+    if not placed:
+        return empty
+
+    parts = []
+    for side, source_df in (("EDW", edw_df), ("Journal", journal_df)):
+        entries = [(n, p) for n, p in enumerate(placed) if p[0] == side]
+        if not entries:
+            continue
+        order, picked = zip(*entries)
+        keys = sides[side][0]
+        rows = _recon_rows(
+            source_df,
+            keys.iloc[[p[1] for p in picked]],
+            side,
+            [p[3] for p in picked],
+            [p[4] for p in picked],
+            [p[2] for p in picked],
+            [p[5] for p in picked],
+        )
+        rows["_order"] = order
+        parts.append(rows)
+    matched = (
+        pd.concat(parts, ignore_index=True)
+        .sort_values("_order", kind="stable")
+        .drop(columns="_order")
+        .reset_index(drop=True)
+    )
+    return (
+        matched,
+        edw_df.drop(index=edw_keys.index[used["EDW"]]),
+        journal_df.drop(index=journal_keys.index[used["Journal"]]),
+    )
+
+
+def unmatched_rows(df, side):
+    """Mark every row of ``df`` UNMATCHED without asking GPT.
+
+    Used when the other side has nothing left to pair against. Returns None if
+    the frame cannot be keyed, in which case the rows go to GPT as before.
+    """
+    keyed = _keyed_frame(df, side, dropna=False)
+    if keyed is None:
+        return None
+    return _recon_rows(df, keyed, side, "UNMATCHED", "NO COUNTERPART", [""] * len(keyed))
+
+
+def interleave(edw_rows, journal_rows):
+    """Stack paired EDW/Journal rows so each pair sits together in the report."""
+    edw_rows = edw_rows.reset_index(drop=True)
+    journal_rows = journal_rows.reset_index(drop=True)
+    edw_rows["_order"] = np.arange(len(edw_rows)) * 2
+    journal_rows["_order"] = np.arange(len(journal_rows)) * 2 + 1
+    stacked = pd.concat([edw_rows, journal_rows], ignore_index=True)
+    return stacked.sort_values("_order", kind="stable").drop(columns="_order").reset_index(drop=True)
+
+
+def concat_rows(*frames):
+    """Concatenate reconciliation frames, skipping empty ones.
+
+    Categoricals with different categories concatenate to object, so the
+    result is normalized again.
+    """
+    frames = [f for f in frames if f is not None and not f.empty]
+    if not frames:
+        return empty_recon()
+    return normalize_recon(pd.concat(frames, ignore_index=True))
+
+
+def number_rows(recon_df):
+    """Renumber the ``No`` column after frames from several passes are combined."""
+    recon_df = recon_df.reset_index(drop=True)
+    recon_df["No"] = np.arange(1, len(recon_df) + 1)
+    return recon_df
+
+
+def renumber_refs(suggestions_df, numbers):
+    """Point the ``No N`` references in a suggestions frame's ``Ref 1`` at the
+    rows' new numbers. ``numbers`` maps old ``No`` values to new ones, as a
+    dict or a function; numbers it does not cover are left as they are."""
+    if suggestions_df is None or suggestions_df.empty or not numbers:
+        return suggestions_df
+    target = suggestions_df["Ref 1"].astype("string")
+    number = pd.to_numeric(target.str.extract(r"^No (\d+)$", expand=False))
+    new = number.map(numbers)
+    suggestions_df = suggestions_df.copy()
+    suggestions_df["Ref 1"] = target.mask(new.notna(), "No " + new.astype("Int64").astype("string"))
+    return suggestions_df
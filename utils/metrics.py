@@ -0,0 +1,178 @@
+# utils/metrics.py
+"""Structured timing, memory, row and GPT usage metrics for a run.
+
+The orchestrator owns one :class:`RunMetrics` and hands it to every agent.
+Agents wrap their work in :meth:`RunMetrics.stage` blocks and the GPT gateway
+counts calls, tokens, retries and latency in the shared :class:`LLMStats`.
+Each call is also counted for the stages it was made in, tracked per thread
+with a context variable, so stages running side by side do not count each
+other's calls. Threads working for a stage should run in a copy of its
+context (``contextvars.copy_context().run``).
+"""
+import contextvars
+import json
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+LLM_COUNTERS = ("calls", "cache_hits", "retries", "prompt_tokens", "completion_tokens")
+FRAME_COLUMNS = ["stage", "rows_in", "rows_out", "wall_s", "process_cpu_s", "peak_alloc_mb"]
+
+# LLMStats of the stages the current thread is working in, outermost first
+_stage_stats = contextvars.ContextVar("stage_stats", default=())
+
+
+def peak_rss_mb():
+    """High-water mark of this process's resident memory, or None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class LLMStats:
+    """Thread-safe counters for GPT calls made through ``utils.llm``."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = dict.fromkeys(LLM_COUNTERS, 0)
+        self.latencies = []
+
+    def record_call(self, latency, prompt_tokens, completion_tokens, retries):
+        counters = {
+            "calls": 1,
+            "retries": retries,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+        }
+        for stats in (self, *_stage_stats.get()):
+            stats._add(counters, [latency])
+
+    def absorb(self, counters, latencies):
+        """Add the counts of calls made elsewhere, e.g. in a worker process."""
+        for stats in (self, *_stage_stats.get()):
+            stats._add(counters, latencies)
+
+    def record_cache_hit(self):
+        for stats in (self, *_stage_stats.get()):
+            stats._add({"cache_hits": 1}, [])
+
+    def _add(self, counters, latencies):
+        with self._lock:
+            for key in LLM_COUNTERS:
+                self.counters[key] += counters.get(key, 0)
+            self.latencies.extend(latencies)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counters), len(self.latencies)
+
+
+def _latency_summary(latencies):
+    if not latencies:
+        return {}
+    series = pd.Series(latencies)
+    return {
+        "llm_latency_mean_s": round(series.mean(), 3),
+        "llm_latency_p95_s": round(series.quantile(0.95), 3),
+        "llm_latency_max_s": round(series.max(), 3),
+    }
+
+
+class RunMetrics:
+    """Per-stage metrics of one orchestrator run.
+
+    ``process_cpu_s`` is the CPU time of the whole process while a stage
+    ran, so stages running side by side each include the other's. The
+    process's peak resident memory is recorded once for the run, as it is
+    a high-water mark that no stage can be charged for alone.
+
+    With ``trace_memory`` each stage also records ``peak_alloc_mb``, the
+    highest level of traced Python allocations above the level it started
+    at (tracemalloc; noticeably slows pandas code). Like the CPU time it
+    covers the whole process while the stage ran.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.llm = LLMStats()
+        self.stages = []
+        # Names of the stages still running, for progress polling
+        self.active = []
+        self.started = time.time()
+        # Peak traced allocations seen by each open stage, keyed by id(record)
+        self._alloc_peaks = {}
+        self._alloc_lock = threading.Lock()
+
+    def _fold_alloc_peak(self):
+        # tracemalloc keeps a single peak: hand it to every open stage before
+        # resetting it, so nested and overlapping stages all keep their own
+        current, peak = tracemalloc.get_traced_memory()
+        for key, seen in self._alloc_peaks.items():
+            self._alloc_peaks[key] = max(seen, peak)
+        tracemalloc.reset_peak()
+        return current
+
+    @contextmanager
+    def stage(self, name, **counts):
+        """Time the block as stage ``name``. Yields the stage record, so
+        counts only known at the end (``rows_out``, ...) can be added to it."""
+        record = {"stage": name, **counts}
+        stats = LLMStats()
+        stage_token = _stage_stats.set(_stage_stats.get() + (stats,))
+        if self.trace_memory:
+            with self._alloc_lock:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                alloc_start = self._fold_alloc_peak()
+                self._alloc_peaks[id(record)] = alloc_start
+        wall, cpu = time.perf_counter(), time.process_time()
+        self.active.append(name)
+        try:
+            yield record
+        finally:
+            self.active.remove(name)
+            _stage_stats.reset(stage_token)
+            record["wall_s"] = round(time.perf_counter() - wall, 3)
+            # Process CPU time, so it includes GPT worker threads
+            record["process_cpu_s"] = round(time.process_time() - cpu, 3)
+            if self.trace_memory:
+                with self._alloc_lock:
+                    self._fold_alloc_peak()
+                    alloc_peak = self._alloc_peaks.pop(id(record))
+                record["peak_alloc_mb"] = round((alloc_peak - alloc_start) / 2**20, 1)
+            llm_counts, _ = stats.snapshot()
+            for key in LLM_COUNTERS:
+                if llm_counts[key]:
+                    record[f"llm_{key}"] = llm_counts[key]
+            record.update(_latency_summary(stats.latencies))
+            self.stages.append(record)
+
+    def to_dict(self):
+        totals, _ = self.llm.snapshot()
+        return {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "stages": self.stages,
+            "llm": {**totals, **_latency_summary(self.llm.latencies)},
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+    def to_frame(self):
+        """One row per stage, for the report's Run Metrics sheet."""
+        frame = pd.DataFrame(self.stages)
+        first = [col for col in FRAME_COLUMNS if col in frame.columns]
+        return frame[first + [col for col in frame.columns if col not in first]]
+
+    def write_json(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2, default=str)
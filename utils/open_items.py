@@ -0,0 +1,224 @@
+# utils/open_items.py
+"""Persistent store of open reconciliation items for incremental runs.
+
+Every source row is fingerprinted on its matching fields. A run only matches
+the rows it has not seen before, together with the UNMATCHED/PARTIAL items
+carried forward from earlier runs on the same accounts, and then records which
+of them are still open. Daily run time then follows the day's volume instead
+of the whole history.
+"""
+import io
+import os
+import sqlite3
+import time
+
+import pandas as pd
+
+from .ingest import coerce_dtypes
+from .schema import FINGERPRINT_COLUMN, find_column, normalize_source, to_display
+
+DEFAULT_STORE_PATH = os.path.join(".cache", "open_items.sqlite")
+
+# Fields a fingerprint is built from; other columns may change between exports
+FINGERPRINT_FIELDS = ("account", "tran_code", "amount", "debit", "credit", "currency", "bus_entity", "reference")
+SQL_BATCH = 500
+
+
+def _canonical(values):
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.dt.strftime("%Y-%m-%d").fillna("")
+    return values.astype("string").str.strip().fillna("")
+
+
+def fingerprint(df, side):
+    """Return a stable 16-hex-digit fingerprint per row of a normalized frame.
+
+    Identical rows are told apart by their occurrence number, so a file that
+    repeats yesterday's two identical rows plus a third yields one new row.
+    """
+    fields = FINGERPRINT_FIELDS[:1] + ("edw_date" if side == "EDW" else "journal_date",) + FINGERPRINT_FIELDS[1:]
+    canonical = pd.DataFrame(index=df.index)
+    for field in fields:
+        col = find_column(df, field)
+        canonical[field] = _canonical(df[col]) if col is not None else ""
+    base = pd.util.hash_pandas_object(canonical, index=False)
+    occurrence = base.groupby(base).cumcount()
+    combined = pd.util.hash_pandas_object(pd.DataFrame({"base": base, "n": occurrence}), index=False)
+    return combined.map(lambda value: f"{value:016x}")
+
+
+def _batches(values, size=SQL_BATCH):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+class OpenItemStore:
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS seen ("
+                "side TEXT NOT NULL, fingerprint TEXT NOT NULL, closed INTEGER NOT NULL, "
+                "updated REAL NOT NULL, PRIMARY KEY (side, fingerprint))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS open_items ("
+                "side TEXT NOT NULL, fingerprint TEXT NOT NULL, account TEXT, value_date TEXT, "
+                "amount INTEGER, status TEXT NOT NULL, row TEXT NOT NULL, first_seen REAL NOT NULL, "
+                "updated REAL NOT NULL, PRIMARY KEY (side, fingerprint))"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS open_items_key ON open_items (side, account, value_date, amount)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _seen(self, conn, side, fingerprints):
+        seen = set()
+        for batch in _batches(fingerprints):
+            marks = ",".join("?" * len(batch))
+            seen.update(
+                fp for (fp,) in conn.execute(
+                    f"SELECT fingerprint FROM seen WHERE side = ? AND fingerprint IN ({marks})", [side, *batch]
+                )
+            )
+        return seen
+
+    def _load_open(self, conn, side, accounts):
+        fps, rows = [], []
+        for batch in _batches(sorted(accounts)):
+            marks = ",".join("?" * len(batch))
+            for fp, row in conn.execute(
+                f"SELECT fingerprint, row FROM open_items WHERE side = ? AND account IN ({marks}) "
+                "ORDER BY first_seen",
+                [side, *batch],
+            ):
+                fps.append(fp)
+                rows.append(row)
+        if not rows:
+            return None
+        # dtype=False keeps references like "00123" as text
+        frame = pd.read_json(io.StringIO("\n".join(rows)), lines=True, dtype=False, convert_dates=False)
+        frame[FINGERPRINT_COLUMN] = fps
+        return normalize_source(coerce_dtypes(frame), side)
+
+    def prepare(self, edw_df, journal_df):
+        """Split normalized EDW/Journal frames into the rows to reconcile now.
+
+        Returns ``(frames, stats)``: ``frames`` maps EDW/Journal to the new rows
+        plus the carried-forward open items on the same accounts, each tagged
+        with a fingerprint column; ``stats`` counts new, skipped and carried
+        rows per side.
+        """
+        sources = {"EDW": edw_df, "Journal": journal_df}
+        frames, stats, deltas = {}, {}, {}
+        with self._connect() as conn:
+            for side, df in sources.items():
+                fps = fingerprint(df, side)
+                seen = self._seen(conn, side, fps)
+                new = ~fps.isin(seen)
+                deltas[side] = df[new].assign(**{FINGERPRINT_COLUMN: fps[new]})
+                stats[side] = {"new": int(new.sum()), "skipped": int((~new).sum()), "carried": 0}
+
+            # Open items can only pair with rows on the same account
+            accounts = set()
+            for delta in deltas.values():
+                col = find_column(delta, "account")
+                if col is not None:
+                    accounts.update(delta[col].dropna().astype(str).str.strip())
+
+            for side, delta in deltas.items():
+                carried = self._load_open(conn, side, accounts) if accounts else None
+                if carried is None:
+                    frames[side] = delta
+                    continue
+                # Carried rows are numbered after the sheet so row labels stay put
+                start = len(sources[side])
+                carried.index = pd.RangeIndex(start, start + len(carried))
+                frames[side] = normalize_source(pd.concat([delta, carried]), side)
+                stats[side]["carried"] = len(carried)
+        return frames, stats
+
+    def update(self, frames, recon_df):
+        """Record the outcome of a run over ``frames`` (as returned by
+        :meth:`prepare`). Rows reported only as MATCHED are closed; every other
+        row, including rows missing from ``recon_df``, stays open.
+
+        Returns ``{"closed": n, "open": n}``.
+        """
+        refs = recon_df["Ref 3"].astype("string").fillna("")
+        outcome = recon_df.assign(fingerprint=refs)[refs != ""].groupby("fingerprint")["Status"]
+        closed_fps = set(fp for fp, all_matched in outcome.agg(lambda s: (s == "MATCHED").all()).items() if all_matched)
+        statuses = outcome.last().astype(str)
+        now = time.time()
+        counts = {"closed": 0, "open": 0}
+
+        with self._connect() as conn:
+            for side, df in frames.items():
+                if df.empty:
+                    continue
+                fps = df[FINGERPRINT_COLUMN].astype(str)
+                closed = fps.isin(closed_fps)
+                conn.executemany(
+                    "INSERT OR REPLACE INTO seen (side, fingerprint, closed, updated) VALUES (?, ?, ?, ?)",
+                    [(side, fp, int(is_closed), now) for fp, is_closed in zip(fps, closed)],
+                )
+                for batch in _batches(fps[closed]):
+                    marks = ",".join("?" * len(batch))
+                    conn.execute(
+                        f"DELETE FROM open_items WHERE side = ? AND fingerprint IN ({marks})", [side, *batch]
+                    )
+
+                still_open = df[~closed]
+                if not still_open.empty:
+                    conn.executemany(
+                        "INSERT INTO open_items "
+                        "(side, fingerprint, account, value_date, amount, status, row, first_seen, updated) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT (side, fingerprint) DO UPDATE SET status = excluded.status, "
+                        "updated = excluded.updated",
+                        self._open_rows(side, still_open, statuses, now),
+                    )
+                counts["closed"] += int(closed.sum())
+                counts["open"] += len(still_open)
+        return counts
+
+    def _open_rows(self, side, df, statuses, now):
+        account_col = find_column(df, "account")
+        date_col = find_column(df, "edw_date" if side == "EDW" else "journal_date")
+        amount_col = find_column(df, "amount") or find_column(df, "debit")
+        payload = to_display(df.drop(columns=FINGERPRINT_COLUMN))
+        rows = payload.to_json(orient="records", lines=True, date_format="iso").splitlines()
+        for position, (index, fp) in enumerate(df[FINGERPRINT_COLUMN].astype(str).items()):
+            account = df.at[index, account_col] if account_col else None
+            value_date = df.at[index, date_col] if date_col else None
+            amount = df.at[index, amount_col] if amount_col else None
+            yield (
+                side,
+                fp,
+                None if pd.isna(account) else str(account).strip(),
+                None if pd.isna(value_date) else pd.Timestamp(value_date).strftime("%Y-%m-%d"),
+                None if pd.isna(amount) else int(amount),
+                statuses.get(fp, "UNMATCHED"),
+                rows[position],
+                now,
+                now,
+            )
+
+    def stats(self):
+        with self._connect() as conn:
+            counts = dict(conn.execute("SELECT side, COUNT(*) FROM open_items GROUP BY side").fetchall())
+        return ", ".join(f"{counts.get(side, 0)} open {side} items" for side in ("EDW", "Journal"))
+
+
+def store_from_config(llm_config):
+    """Build the open-items store when ``incremental`` is on in the agent
+    config, else None."""
+    if not llm_config.get("incremental"):
+        return None
+    return OpenItemStore(llm_config.get("open_items_path") or DEFAULT_STORE_PATH)
@@ -1,14 +1,75 @@
 # utils/pdf_parser.py
+import hashlib
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+SOP_CACHE_DIR = os.path.join(".cache", "sop")
+SOP_CACHE_MAX_AGE_SECONDS = 30 * 86400
+# Below this many pages, process start-up costs more than it saves
+PARALLEL_MIN_PAGES = 40
+
+
+def _extract_pages(pdf_bytes, start, stop):
+    # Each worker opens its own document; fitz documents are not shareable
+    import fitz  # PyMuPDF
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        return [doc[i].get_text() for i in range(start, stop)]
+
+
+def _evict_stale(cache_dir, max_age_seconds):
+    now = time.time()
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        try:
+            if now - os.path.getmtime(path) > max_age_seconds:
+                os.remove(path)
+        except OSError:
+            continue
+
+
+def extract_text_from_pdf(
+    uploaded_pdf, cache_dir=SOP_CACHE_DIR, max_workers=None, max_age_seconds=SOP_CACHE_MAX_AGE_SECONDS
+):
+    """Extract text from PDF file. Returns empty string if PDF parsing is not available.
+
+    Text is cached on disk by a hash of the PDF content, so the same SOP is
+    parsed only once; texts older than ``max_age_seconds`` are evicted when
+    another one is cached. Long documents are split into page ranges that
+    are extracted in parallel processes.
+    """
+    pdf_bytes = uploaded_pdf.read()
+    digest = hashlib.sha256(pdf_bytes).hexdigest()
+    cache_path = os.path.join(cache_dir, f"{digest}.txt") if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        if time.time() - os.path.getmtime(cache_path) <= max_age_seconds:
+            with open(cache_path, encoding="utf-8") as f:
+                return f.read()
 
-def extract_text_from_pdf(uploaded_pdf):
-    """Extract text from PDF file. Returns empty string if PDF parsing is not available."""
     try:
         import fitz  # PyMuPDF
-        doc = fitz.open(stream=uploaded_pdf.read(), filetype="pdf")
-        text = ""
-        for page in doc:
-            text += page.get_text()
-        return text
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+            page_count = doc.page_count
     except ImportError:
         print("Warning: PyMuPDF not available. PDF parsing will be disabled.")
         return ""
+
+    workers = min(max_workers or os.cpu_count() or 1, 8)
+    if page_count < PARALLEL_MIN_PAGES or workers < 2:
+        pages = _extract_pages(pdf_bytes, 0, page_count)
+    else:
+        step = -(-page_count // workers)
+        ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+        # Spawned, not forked: this may run in a thread of a multi-threaded server
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            parts = pool.map(_extract_pages, *zip(*[(pdf_bytes, a, b) for a, b in ranges]))
+            pages = [page for part in parts for page in part]
+    text = "".join(pages)
+
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        _evict_stale(cache_dir, max_age_seconds)
+        with open(cache_path, "w", encoding="utf-8") as f:
+            f.write(text)
+    return text
@@ -0,0 +1,131 @@
+# utils/pipeline.py
+"""Threads connected by bounded queues, for overlapping the agent stages.
+
+A stage is a function running in its own thread that reads from and writes
+to :class:`Channel` objects. Channels are bounded, so a fast producer waits
+for its consumer instead of piling up rows in memory. When any stage fails,
+the whole pipeline is cancelled and the first error is raised to the caller.
+"""
+import contextvars
+import queue
+import threading
+
+_CLOSED = object()
+POLL_SECONDS = 0.1
+
+
+class PipelineCancelled(Exception):
+    """Raised inside a stage when another stage has failed."""
+
+
+class Channel:
+    def __init__(self, maxsize, cancelled):
+        self._queue = queue.Queue(maxsize)
+        self._cancelled = cancelled
+
+    def put(self, item):
+        """Block until there is room for ``item``."""
+        while True:
+            if self._cancelled.is_set():
+                raise PipelineCancelled()
+            try:
+                self._queue.put(item, timeout=POLL_SECONDS)
+                return
+            except queue.Full:
+                continue
+
+    def close(self):
+        """Tell the consumer no more items will come."""
+        self.put(_CLOSED)
+
+    def _get(self):
+        while True:
+            try:
+                return self._queue.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                if self._cancelled.is_set():
+                    raise PipelineCancelled()
+
+    def __iter__(self):
+        while True:
+            item = self._get()
+            if item is _CLOSED:
+                return
+            yield item
+
+    def batches(self):
+        """Yield lists of items: each waits for one item, then takes every
+        item already queued behind it, so a slow consumer catches up in
+        larger batches."""
+        while True:
+            item = self._get()
+            if item is _CLOSED:
+                return
+            batch = [item]
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _CLOSED:
+                    yield batch
+                    return
+                batch.append(item)
+            yield batch
+
+
+class Pipeline:
+    """Context manager running stages in threads.
+
+    Leaving the block joins every stage. If the block or any stage raised,
+    the other stages are cancelled and the first real error is re-raised.
+    """
+
+    def __init__(self, queue_size=4):
+        self.queue_size = queue_size
+        self._cancelled = threading.Event()
+        self._threads = {}
+        self._results = {}
+        self._errors = []
+
+    def channel(self):
+        return Channel(self.queue_size, self._cancelled)
+
+    def start(self, name, func, *args):
+        def target():
+            try:
+                self._results[name] = func(*args)
+            except PipelineCancelled:
+                pass
+            except BaseException as e:
+                self._errors.append(e)
+                self._cancelled.set()
+
+        # Stages run in a copy of the caller's context, e.g. its metrics stages
+        context = contextvars.copy_context()
+        thread = threading.Thread(target=context.run, args=(target,), name=f"pipeline-{name}", daemon=True)
+        self._threads[name] = thread
+        thread.start()
+
+    def result(self, name):
+        """Wait for stage ``name`` and return what its function returned."""
+        self._threads[name].join()
+        self._raise_errors()
+        return self._results.get(name)
+
+    def _raise_errors(self):
+        if self._errors:
+            raise self._errors[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self._cancelled.set()
+        for thread in self._threads.values():
+            thread.join()
+        if exc_type is None or exc_type is PipelineCancelled:
+            # A cancelled caller reports the stage error that caused it
+            self._raise_errors()
+        return False
@@ -0,0 +1,205 @@
+# utils/prompt_codec.py
+"""Compact encoding of agent data for GPT prompts.
+
+Only the columns the matching rules use are sent. Repeated labels (account,
+Tran Code, currency, Bus Entity) are replaced by short codes listed in a
+legend, and every row is identified by a short row ID instead of its long
+references. Codes and IDs in GPT's answer are mapped back after parsing.
+"""
+import pandas as pd
+
+from .batching import estimate_tokens
+from .schema import MINOR_UNITS, find_column, is_minor_units
+
+CODE_MARK = "#"
+
+# (prompt column, schema field, kind); kind "code" columns are dictionary-encoded
+SOURCE_FIELDS = {
+    "EDW": [
+        ("Account", "account", "code"),
+        ("Tran Code", "tran_code", "code"),
+        ("Date", "edw_date", "date"),
+        ("Amount", "amount", "amount"),
+        ("CCY", "currency", "code"),
+        ("Bus Entity", "bus_entity", "code"),
+    ],
+    "Journal": [
+        ("Account", "account", "code"),
+        ("Tran Code", "tran_code", "code"),
+        ("Date", "journal_date", "date"),
+        ("Amount", "amount", "amount"),
+        ("Debit", "debit", "amount"),
+        ("Credit", "credit", "amount"),
+        ("CCY", "currency", "code"),
+        ("Bus Entity", "bus_entity", "code"),
+    ],
+}
+RECON_FIELDS = [
+    ("Item Type", "Item Type", "text"),
+    ("Account", "Reconciliation", "code"),
+    ("Value Date", "Value Date", "date"),
+    ("Ref 1", "Ref 1", "text"),
+    ("Amount", "Amount", "amount"),
+    ("CCY", "Amt CCY", "code"),
+    ("Bus Entity", "Bus Entity", "code"),
+    ("Rule", "Rule", "text"),
+    ("Tran Code", "Tran Code", "code"),
+    ("Status", "Status", "text"),
+]
+CODE_PREFIXES = {"Account": "A", "Tran Code": "T", "CCY": "C", "Bus Entity": "B"}
+ID_PREFIXES = {"EDW": "E", "Journal": "J", "Recon": "R"}
+
+
+def _format_amount(values):
+    if not is_minor_units(values):
+        values = (pd.to_numeric(values, errors="coerce") * MINOR_UNITS).round().astype("Int64")
+    # Plain decimals without trailing zeros; zero and missing amounts are blank
+    as_float = values.astype("Float64") / MINOR_UNITS
+    text = as_float.map(lambda v: "" if pd.isna(v) or v == 0 else f"{v:.2f}".rstrip("0").rstrip("."))
+    return text.astype(str)
+
+
+def _format_date(values):
+    dates = pd.to_datetime(values, errors="coerce", format="mixed")
+    return dates.dt.strftime("%Y-%m-%d").fillna("")
+
+
+def _format_text(values):
+    return values.astype("string").fillna("").str.strip().astype(str)
+
+
+class PromptCodec:
+    """Encodes frames for prompts and decodes GPT output back.
+
+    One codec is shared by all blocks of an agent run, so row IDs and codes are
+    unique across blocks and decoding works on the merged output.
+    """
+
+    def __init__(self, min_repeats=2):
+        self.min_repeats = min_repeats
+        self.codes = {}  # prompt column -> {value: code}
+        self.values = {}  # code -> value
+        self.rows = {}  # row id -> (side, index)
+        self.constants = {}  # (side, prompt column) -> value shared by every row
+
+    def _code_values(self, df, side):
+        """Yield ``(prompt column, text values)`` for the code columns of ``df``."""
+        fields = RECON_FIELDS if side == "Recon" else SOURCE_FIELDS[side]
+        for name, field, kind in fields:
+            col = field if side == "Recon" else find_column(df, field)
+            if kind == "code" and col is not None and col in df.columns:
+                yield name, _format_text(df[col])
+
+    def learn_codes(self, *inputs):
+        """Decide codes from the value counts of several ``(df, side)`` inputs
+        taken together, before any of them is compacted. Blocks are grouped by
+        the encoded values, so a value must get the same code on every side,
+        even when it repeats on only one of them."""
+        values = {}
+        for df, side in inputs:
+            for name, text in self._code_values(df, side):
+                values.setdefault(name, []).append(text)
+        for name, texts in values.items():
+            self._assign_codes(name, pd.concat(texts).value_counts())
+
+    def compact(self, df, side):
+        """Return a string frame with a row ``id`` and only the prompt columns."""
+        fields = RECON_FIELDS if side == "Recon" else SOURCE_FIELDS[side]
+        prefix = ID_PREFIXES[side]
+        compact = pd.DataFrame({"id": [f"{prefix}{i}" for i in df.index]}, index=df.index)
+        for row_id, index in zip(compact["id"], df.index):
+            self.rows[row_id] = (side, index)
+
+        for name, field, kind in fields:
+            col = field if side == "Recon" else find_column(df, field)
+            if col is None or col not in df.columns:
+                continue
+            if kind == "amount":
+                compact[name] = _format_amount(df[col])
+            elif kind == "date":
+                compact[name] = _format_date(df[col])
+            else:
+                compact[name] = _format_text(df[col])
+                if kind == "code":
+                    compact[name] = self._encode(name, compact[name])
+        keep = ["id"]
+        for col in compact.columns[1:]:
+            distinct = compact[col].unique()
+            if len(distinct) == 1 and len(compact) > 1:
+                # Blank throughout carries nothing; one shared value goes to the legend
+                if distinct[0] != "":
+                    self.constants[(side, col)] = self.values.get(distinct[0], distinct[0])
+                continue
+            keep.append(col)
+        return compact[keep]
+
+    def _encode(self, name, values):
+        mapping = self._assign_codes(name, values.value_counts())
+        return values.map(lambda v: mapping.get(v, v))
+
+    def _assign_codes(self, name, counts):
+        mapping = self.codes.setdefault(name, {})
+        for value, count in counts.items():
+            if value == "" or value in mapping:
+                continue
+            code = f"{CODE_MARK}{CODE_PREFIXES[name]}{len(mapping) + 1}"
+            # Only worth it for labels that repeat and are longer than their code
+            if count >= self.min_repeats and len(value) > len(code) + 1:
+                mapping[value] = code
+                self.values[code] = value
+        return mapping
+
+    def legend(self, *frames):
+        """Legend lines for the codes used in ``frames`` and for the columns
+        left out because every row shares one value."""
+        used = set()
+        for frame in frames:
+            for col in frame.columns:
+                if col in CODE_PREFIXES:
+                    used.update(v for v in frame[col].unique() if v in self.values)
+        lines = [f"{code} = {self.values[code]}" for code in sorted(used, key=lambda c: (c[1], int(c[2:])))]
+        lines += [f"{col} is {value} for every {side} row" for (side, col), value in self.constants.items()]
+        return "\n".join(lines) if lines else "(no codes used)"
+
+    def distinct_values(self, frames, column):
+        """Decoded distinct values of ``column`` across ``frames``."""
+        values = set()
+        for frame in frames:
+            if column in frame.columns:
+                values.update(self.decode_value(v) for v in frame[column].unique() if v)
+        for (_, col), value in self.constants.items():
+            if col == column:
+                values.add(value)
+        return sorted(values)
+
+    def decode_value(self, value):
+        return self.values.get(value.strip(), value) if isinstance(value, str) else value
+
+    def lookup(self, row_id):
+        """Return ``(side, index)`` for a row ID, or None if GPT made one up."""
+        return self.rows.get(row_id.strip()) if isinstance(row_id, str) else None
+
+    def decode_records(self, records, id_column, resolve, extra=None):
+        """Decode codes in every field and replace the row ID in ``id_column``
+        with ``resolve(side, index)``; unknown IDs are left as GPT wrote them.
+        ``extra(side, index)`` may return more fields to set on known rows."""
+        decoded = []
+        for record in records:
+            record = {key: self.decode_value(value) for key, value in record.items()}
+            found = self.lookup(record.get(id_column))
+            if found is not None:
+                record[id_column] = resolve(*found)
+                if extra is not None:
+                    record.update(extra(*found))
+            decoded.append(record)
+        return decoded
+
+
+def to_prompt_csv(compact_df):
+    return compact_df.to_csv(index=False)
+
+
+def check_budget(prompt, max_tokens):
+    """Return the estimated tokens of ``prompt`` and whether it fits ``max_tokens``."""
+    tokens = estimate_tokens(prompt)
+    return tokens, max_tokens is None or tokens <= max_tokens
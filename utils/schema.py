@@ -0,0 +1,174 @@
+# utils/schema.py
+"""Column names and storage types shared by all agents.
+
+Frames are normalized once when they enter an agent:
+
+- amounts are nullable ``Int64`` minor units (cents; every currency is taken
+  to have two decimals), so sums and comparisons are exact,
+- dates are ``datetime64``,
+- low-cardinality labels (Amt CCY, Tran Code, Bus Entity, Status, ...) are
+  categoricals.
+
+``Int64`` is used for minor-unit amounts only, which keeps normalization
+idempotent. :func:`to_display` turns amounts back into decimals for prompts
+and the Excel report.
+"""
+import pandas as pd
+
+MINOR_UNITS = 100
+
+RECON_COLUMNS = [
+    "No", "Item Type", "Reconciliation", "SIDE", "Value Date", "Ref 1", "Amount",
+    "Amt CCY", "Bus Entity", "Stmt Date", "Rule", "ENTRY DATE", "Ref 2", "Ref 3",
+    "Ref 4", "Tran Code", "Status",
+]
+STATUSES = ["MATCHED", "PARTIAL", "UNMATCHED"]
+
+RECON_DATE_COLUMNS = ["Value Date", "Stmt Date", "ENTRY DATE"]
+RECON_CATEGORY_COLUMNS = ["Item Type", "SIDE", "Amt CCY", "Bus Entity", "Rule", "Tran Code"]
+RECON_TEXT_COLUMNS = ["Reconciliation", "Ref 1", "Ref 2", "Ref 3", "Ref 4"]
+
+# Accepted header spellings for EDW/Journal fields, first hit wins.
+COLUMN_ALIASES = {
+    "account": ["Account Number", "Account No", "Account", "Acct No", "Reconciliation"],
+    "tran_code": ["Tran Code", "Transaction Code", "Txn Code"],
+    "edw_date": ["Process Date", "Transaction Date", "Value Date", "Date"],
+    "journal_date": ["Journal Date", "ENTRY DATE", "Entry Date", "Value Date", "Date"],
+    "amount": ["Amount", "Amt"],
+    "debit": ["Debit Amount", "Debit"],
+    "credit": ["Credit Amount", "Credit"],
+    "currency": ["Amt CCY", "Currency", "CCY"],
+    "bus_entity": ["Bus Entity", "Business Entity", "Entity"],
+    "stmt_date": ["Stmt Date", "Statement Date"],
+    "reference": ["Ref 1", "Reference", "Ref", "Transaction Ref"],
+}
+AMOUNT_FIELDS = ("amount", "debit", "credit")
+
+# Source rows tagged by the open-items store carry their fingerprint here; it
+# is copied to Ref 3 of the reconciliation rows describing them.
+FINGERPRINT_COLUMN = "Fingerprint"
+
+
+def find_column(df, field):
+    """Return the first column of ``df`` matching one of the aliases for ``field``."""
+    lookup = {str(col).strip().lower(): col for col in df.columns}
+    for alias in COLUMN_ALIASES[field]:
+        if alias.lower() in lookup:
+            return lookup[alias.lower()]
+    return None
+
+
+def row_label(side, index):
+    """Spreadsheet row of a source row (header on row 1), used when it has no
+    reference of its own."""
+    return f"{side}:{index + 2}"
+
+
+def source_reference(df, side, index):
+    """The reference of row ``index`` of an EDW or Journal frame."""
+    ref_col = find_column(df, "reference")
+    if ref_col is not None and pd.notna(df.at[index, ref_col]):
+        return str(df.at[index, ref_col])
+    return row_label(side, index)
+
+
+def is_minor_units(values):
+    return isinstance(values.dtype, pd.Int64Dtype)
+
+
+def to_minor_units(values):
+    """Convert an amount series to nullable ``Int64`` minor units; series that
+    already are minor units are returned unchanged."""
+    if is_minor_units(values):
+        return values
+    if values.dtype == object:
+        # Spreadsheet exports often carry thousands separators
+        values = values.astype(str).str.replace(",", "", regex=False).str.strip()
+    numeric = pd.to_numeric(values, errors="coerce")
+    return (numeric * MINOR_UNITS).round().astype("Int64")
+
+
+def _to_datetime(values):
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    return pd.to_datetime(values, errors="coerce", format="mixed")
+
+
+def _to_category(values):
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values
+    return values.where(values.isna(), values.astype(str).str.strip()).astype("category")
+
+
+def normalize_source(df, side):
+    """Return a normalized copy of an EDW or Journal frame."""
+    df = df.copy()
+    for field in AMOUNT_FIELDS:
+        col = find_column(df, field)
+        if col is not None:
+            df[col] = to_minor_units(df[col])
+    for field in ("edw_date" if side == "EDW" else "journal_date", "stmt_date"):
+        col = find_column(df, field)
+        if col is not None:
+            df[col] = _to_datetime(df[col])
+    for field in ("currency", "tran_code", "bus_entity"):
+        col = find_column(df, field)
+        if col is not None:
+            df[col] = _to_category(df[col])
+    return df
+
+
+def normalize_status(values):
+    """Upper-case statuses into the MATCHED/PARTIAL/UNMATCHED categorical;
+    missing or unknown values become UNMATCHED."""
+    if isinstance(values.dtype, pd.CategoricalDtype) and list(values.cat.categories) == STATUSES:
+        return values.fillna("UNMATCHED")
+    cleaned = values.astype("string").str.strip().str.upper()
+    return pd.Categorical(cleaned, categories=STATUSES).fillna("UNMATCHED")
+
+
+def normalize_recon(df):
+    """Return ``df`` with exactly the 17 reconciliation columns, typed.
+
+    Missing columns are added empty and extra columns (e.g. stray GPT output)
+    are dropped.
+    """
+    df = df.reindex(columns=RECON_COLUMNS).reset_index(drop=True)
+    # Rows without a number keep their position so "No" stays a plain int64
+    position = pd.Series(range(1, len(df) + 1), index=df.index)
+    df["No"] = pd.to_numeric(df["No"], errors="coerce").fillna(position).astype("int64")
+    df["Amount"] = to_minor_units(df["Amount"])
+    for col in RECON_DATE_COLUMNS:
+        df[col] = _to_datetime(df[col])
+    for col in RECON_CATEGORY_COLUMNS:
+        df[col] = _to_category(df[col])
+    for col in RECON_TEXT_COLUMNS:
+        df[col] = df[col].astype("string")
+    df["Status"] = normalize_status(df["Status"])
+    return df
+
+
+def validate_recon(df):
+    """Raise ``ValueError`` unless ``df`` carries the reconciliation schema."""
+    missing = [col for col in RECON_COLUMNS if col not in df.columns]
+    if missing:
+        raise ValueError(f"Reconciliation data is missing columns: {', '.join(missing)}")
+    if not is_minor_units(df["Amount"]):
+        raise ValueError("Reconciliation Amount must be normalized to minor units")
+    if not isinstance(df["Status"].dtype, pd.CategoricalDtype):
+        raise ValueError("Reconciliation Status must be normalized")
+
+
+def empty_recon():
+    return normalize_recon(pd.DataFrame(columns=RECON_COLUMNS))
+
+
+def to_display(df):
+    """Copy of ``df`` with minor-unit amounts turned back into decimals."""
+    minor_cols = [col for col in df.columns if is_minor_units(df[col])]
+    if not minor_cols:
+        return df
+    df = df.copy()
+    for col in minor_cols:
+        df[col] = df[col].astype("Float64") / MINOR_UNITS
+    return df
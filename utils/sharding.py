@@ -0,0 +1,114 @@
+# utils/sharding.py
+"""Split one workbook into independent shards and merge their results.
+
+Matching never crosses accounts, so every account lands whole in one shard
+with both of its sides. The shard is picked by a hash of the account's Bus
+Entity (from the EDW side, as Journals rarely carry it) and account number.
+
+Shards are handed to worker processes as Arrow IPC files that the workers
+memory-map, instead of pickling DataFrames through the process pool.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from .matching import concat_rows, number_rows, renumber_refs
+from .schema import find_column
+
+_GROUP_ID = r"^AUTO-\d+$"
+
+
+def _accounts(df):
+    account_col = find_column(df, "account")
+    if account_col is None:
+        return None
+    return df[account_col].astype(str).str.strip()
+
+
+def shard_ids(edw_df, journal_df, n_shards):
+    """Return ``(edw_ids, journal_ids)``: the shard of every row, or None
+    when either side has no account column and the workbook cannot be split."""
+    edw_accounts, journal_accounts = _accounts(edw_df), _accounts(journal_df)
+    if edw_accounts is None or journal_accounts is None:
+        return None
+    entity_col = find_column(edw_df, "bus_entity")
+    entity_of = (
+        edw_df[entity_col].astype(str).str.strip().groupby(edw_accounts).first()
+        if entity_col
+        else pd.Series(dtype=str)
+    )
+
+    def ids(accounts):
+        keys = accounts.map(entity_of).fillna("") + "|" + accounts
+        # hash_pandas_object is stable across processes and runs, unlike hash()
+        hashes = pd.util.hash_pandas_object(keys, index=False).to_numpy()
+        return pd.Series((hashes % np.uint64(n_shards)).astype(np.int64), index=accounts.index)
+
+    return ids(edw_accounts), ids(journal_accounts)
+
+
+def _arrow_table(df):
+    try:
+        return pa.Table.from_pandas(df, preserve_index=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Object columns mixing types (e.g. numbers and text) go over as text
+        objects = {col: "string" for col in df.columns if df[col].dtype == object}
+        return pa.Table.from_pandas(df.astype(objects), preserve_index=True)
+
+
+def write_frames(frames, directory):
+    """Write ``{name: df}`` as Arrow IPC files in ``directory``; returns
+    ``{name: path}``. None frames are skipped."""
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for name, df in frames.items():
+        if df is None:
+            continue
+        table = _arrow_table(df)
+        path = os.path.join(directory, f"{name}.arrow")
+        with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        paths[name] = path
+    return paths
+
+
+def read_frames(paths):
+    """Memory-map the Arrow IPC files written by :func:`write_frames`."""
+    return {
+        name: pa.ipc.open_file(pa.memory_map(path)).read_all().to_pandas()
+        for name, path in paths.items()
+    }
+
+
+def merge_shards(parts):
+    """Merge per-shard ``(recon_df, suggestions_df)`` results in shard order.
+
+    Rows keep their order within and across shards and are numbered once
+    more. Match group IDs (``AUTO-...``) start over in every shard, so they
+    are renumbered, and suggestions follow their rows' new group IDs and
+    numbers. Returns ``(recon_df, suggestions_df)``; the latter is None when
+    no shard had suggestions.
+    """
+    recons, suggestions = [], []
+    next_group, offset = 1, 0
+    for recon_df, suggestions_df in parts:
+        ref = recon_df["Ref 1"].astype("string")
+        is_group = ref.str.match(_GROUP_ID).fillna(False)
+        codes, groups = pd.factorize(ref[is_group])
+        new_ids = np.array([f"AUTO-{n:06d}" for n in range(next_group, next_group + len(groups))], dtype=object)
+        next_group += len(groups)
+        ref[is_group] = new_ids[codes]
+        mapping = dict(zip(groups, new_ids))
+        recons.append(recon_df.assign(**{"Ref 1": ref}))
+
+        if suggestions_df is not None and not suggestions_df.empty:
+            suggestions_df = renumber_refs(suggestions_df, lambda n, offset=offset: n + offset)
+            suggestions_df["Ref 1"] = suggestions_df["Ref 1"].replace(mapping)
+            suggestions.append(suggestions_df)
+        offset += len(recon_df)
+
+    recon_df = number_rows(concat_rows(*recons))
+    suggestions_df = pd.concat(suggestions, ignore_index=True) if suggestions else None
+    return recon_df, suggestions_df
@@ -0,0 +1,90 @@
+# utils/sop_index.py
+"""Local BM25 retrieval over SOP sections.
+
+Long policy manuals would otherwise be pasted whole into every GPT call. The
+SOP is split into sections once and each call gets only the sections most
+relevant to the Tran Codes and issues in its batch.
+"""
+import math
+import re
+from collections import Counter
+from functools import lru_cache
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+# Numbered ("1.", "2.3", "Section 4"), upper-case or colon-terminated lines
+_HEADING = re.compile(r"^\s*(?:(?:[Ss]ection\s+)?\d+(?:\.\d+)*[.)]?\s+\S.*|[A-Z][A-Z0-9 &/\-]{3,80}|.{3,80}:)\s*$")
+
+
+def tokenize(text):
+    return _TOKEN.findall(text.lower())
+
+
+def split_sections(text, max_words=250):
+    """Split SOP text at headings and blank lines into sections of at most
+    ``max_words`` words, keeping document order."""
+    sections, current = [], []
+
+    def flush():
+        body = "\n".join(current).strip()
+        if body:
+            words = body.split()
+            for start in range(0, len(words), max_words):
+                sections.append(" ".join(words[start:start + max_words]))
+        current.clear()
+
+    for line in text.splitlines():
+        if _HEADING.match(line) and current:
+            flush()
+        current.append(line)
+        if not line.strip() and len(" ".join(current).split()) >= max_words // 2:
+            flush()
+    flush()
+    return sections
+
+
+class SOPIndex:
+    """Okapi BM25 over SOP sections."""
+
+    def __init__(self, text, k1=1.5, b=0.75):
+        self.sections = split_sections(text)
+        self.k1, self.b = k1, b
+        self.term_freqs = [Counter(tokenize(section)) for section in self.sections]
+        self.lengths = [sum(tf.values()) for tf in self.term_freqs]
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0
+        doc_freq = Counter(term for tf in self.term_freqs for term in tf)
+        n = len(self.sections)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in doc_freq.items()}
+
+    def scores(self, query):
+        terms = set(tokenize(query))
+        scores = []
+        for tf, length in zip(self.term_freqs, self.lengths):
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * length / (self.avg_length or 1))
+            for term in terms:
+                if term in tf:
+                    score += self.idf[term] * tf[term] * (self.k1 + 1) / (tf[term] + norm)
+            scores.append(score)
+        return scores
+
+    def top_k(self, query, k=5):
+        """The ``k`` best-scoring sections for ``query``, in document order."""
+        scores = self.scores(query)
+        best = sorted(range(len(scores)), key=lambda i: -scores[i])[:k]
+        return [self.sections[i] for i in sorted(best) if scores[i] > 0]
+
+
+@lru_cache(maxsize=8)
+def get_index(text):
+    """Index for ``text``, built once per distinct SOP."""
+    return SOPIndex(text)
+
+
+def relevant_sop(sop_text, query, max_words=1500, k=5):
+    """Return the SOP to put in a prompt: the whole text when it is at most
+    ``max_words`` words, else the top ``k`` sections for ``query``."""
+    if not sop_text or len(sop_text.split()) <= max_words:
+        return sop_text
+    sections = get_index(sop_text).top_k(query, k)
+    # Nothing relevant found: fall back to the opening sections
+    return "\n\n".join(sections or get_index(sop_text).sections[:k])